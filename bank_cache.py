@@ -0,0 +1,131 @@
+"""
+Persistent cache of the parsed bank of questions.
+
+Each file of the bank is stored with the questions obtained after
+inner_load_questions processed it. The entry is valid while the file keeps
+the same modification time and size.
+"""
+
+import logging
+import pickle
+import tempfile
+from pathlib import Path
+from typing import List, Optional
+
+from replace_file import replace_file
+
+log = logging.getLogger(__name__)
+
+# increment when the format of the questions stored changes
+CACHE_VERSION = 3
+CACHE_NAME = ".rand-exam-cache.pickle"
+
+
+def cache_filename(bank: Path) -> Path:
+    """
+    Filename of the cache of a bank (directory or single file)
+    """
+    if bank.is_dir():
+        return bank / CACHE_NAME
+
+    return bank.with_name(f".{bank.name}{CACHE_NAME}")
+
+
+class BankCache:
+    """
+    On-disk cache of the questions loaded from every file of the bank
+
+    attributes:
+        path: file where the cache is stored
+        entries: key -> (mtime_ns, size, questions) read from disk
+        updated: entries checked or added in this run (written in save)
+        dirty: the cache file has to be rewritten
+    """
+
+    def __init__(self, bank: Path):
+        self.path = cache_filename(bank)
+        self.entries = {}
+        self.updated = {}
+        self.dirty = False
+
+        self.load()
+
+    @staticmethod
+    def key(path: Path):
+        """
+        Key of a file in the cache and its current signature (mtime, size)
+        """
+        stat = path.stat()
+        return str(path.resolve()), (stat.st_mtime_ns, stat.st_size)
+
+    def load(self):
+        """
+        Read the cache file. A missing, old or broken cache is ignored.
+        """
+        if not self.path.exists():
+            return
+
+        try:
+            with self.path.open("rb") as fh:
+                version, entries = pickle.load(fh)
+        except Exception as exc:  # pylint: disable=broad-except
+            log.warning("cache %s ignored: %s", self.path, exc)
+            return
+
+        if version != CACHE_VERSION:
+            log.info("cache %s ignored: old version %s", self.path, version)
+            return
+
+        self.entries = entries
+
+    def get(self, path: Path) -> Optional[List]:
+        """
+        Questions of path if the file didn't change since it was cached
+        """
+        key, signature = self.key(path)
+        entry = self.entries.get(key)
+
+        if entry is None or entry[0] != signature:
+            return None
+
+        self.updated[key] = entry
+        return entry[1]
+
+    def put(self, path: Path, questions: List):
+        """
+        Store the questions loaded from path
+        """
+        key, signature = self.key(path)
+        self.updated[key] = (signature, questions)
+        self.dirty = True
+
+    def save(self):
+        """
+        Write the cache if something changed. Files no longer in the bank
+        are dropped.
+        """
+        if not self.dirty and len(self.updated) == len(self.entries):
+            return
+
+        # a temporary file for each writer: runs in parallel over the same
+        # bank (make -j) don't write over each other, the last one wins
+        tmp_name = None
+        try:
+            with tempfile.NamedTemporaryFile(
+                "wb",
+                dir=self.path.parent,
+                prefix=f"{self.path.name}.",
+                suffix=".tmp",
+                delete=False,
+            ) as fh:
+                tmp_name = fh.name
+                pickle.dump((CACHE_VERSION, self.updated), fh, pickle.HIGHEST_PROTOCOL)
+            replace_file(tmp_name, self.path)
+        except OSError as exc:
+            log.warning("cache %s not saved: %s", self.path, exc)
+            if tmp_name is not None:
+                Path(tmp_name).unlink(missing_ok=True)
+            return
+
+        self.entries = self.updated
+        self.dirty = False
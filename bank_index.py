@@ -0,0 +1,413 @@
+"""
+Memory-mapped binary index of a bank of questions.
+
+`rand-exam.py index BANK` compiles the questions of the bank into one file
+(see index_filename). The next runs map it instead of loading the bank while
+it is up to date: the metadata used to select questions is read from
+fixed-width arrays, the tags from bitsets, and the yaml document of a
+question is decoded only when the question is rendered.
+
+Layout of the file:
+    MAGIC | length of the header (uint64, little endian) | header (json)
+    sections (arrays, native byte order), aligned to 8 bytes
+
+The header has the files of the bank with their signature, the tables of
+tags and orders of keys, and the position of each section.
+"""
+
+import json
+import logging
+import mmap
+import pickle
+import struct
+import sys
+import tempfile
+from array import array
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+from bank_cache import BankCache
+from question import Question, read_source
+from replace_file import replace_file
+from yaml_loader import safe_load
+
+log = logging.getLogger(__name__)
+
+# increment when the format of the file changes
+INDEX_VERSION = 2
+INDEX_NAME = ".rand-exam-index.bin"
+MAGIC = b"REXINDEX"
+ALIGNMENT = 8
+
+# kind of the values of difficulty and frequency (stored as float)
+KIND_INT = 0
+KIND_FLOAT = 1
+KIND_NONE = 2
+
+# flags of each question
+FLAG_SCAFFOLD = 1
+FLAG_AUTOTAG = 2
+FLAG_PICKLED = 4  # body is the pickle of the fields, not a yaml document
+
+# name -> typecode of the arrays stored (in this order)
+SECTIONS = {
+    "difficulty": "d",
+    "frequency": "d",
+    "difficulty_kind": "B",
+    "frequency_kind": "B",
+    "flags": "B",
+    "order": "I",
+    "tag_start": "I",
+    "tag_ids": "I",
+    "bitsets": "B",
+    "id_start": "Q",
+    "ids": "B",
+    "body_start": "Q",
+    "bodies": "B",
+}
+
+# blob sections -> section with the start of each question (and the end)
+BLOBS = {"ids": "id_start", "bodies": "body_start"}
+
+
+def index_filename(bank: Path) -> Path:
+    """
+    Filename of the index of a bank (directory or single file)
+    """
+    if bank.is_dir():
+        return bank / INDEX_NAME
+
+    return bank.with_name(f".{bank.name}{INDEX_NAME}")
+
+
+def signatures(files: List[Path]) -> List:
+    """
+    [file, mtime_ns, size] of each file of the bank (as stored in the header)
+    """
+    return [
+        [key, mtime, size]
+        for key, (mtime, size) in (BankCache.key(path) for path in files)
+    ]
+
+
+def number_kind(question, key: str) -> int:
+    """
+    Kind of the value of key (difficulty or frequency) in question
+    """
+    value = getattr(question, key)
+    if value is None:
+        return KIND_NONE
+    if type(value) is int and abs(value) < 2**53:
+        return KIND_INT
+    if type(value) is float:
+        return KIND_FLOAT
+
+    raise ValueError(
+        f"question {question.id}: {key} {value!r} cannot be indexed (not a number)"
+    )
+
+
+def check_json(value, description: str):
+    """
+    Check that value is kept by the json header (str, int, float, bool, None)
+    """
+    if value is not None and type(value) not in (str, int, float, bool):
+        raise ValueError(f"{description} {value!r} cannot be indexed")
+
+
+def write_index(path: Path, files_signature: List, questions: List):
+    """
+    Write the index of questions, loaded from the files of files_signature.
+
+    The signatures (see signatures) have to be taken before loading the
+    questions, so the index is out of date if a file changes meanwhile.
+    """
+    arrays = {name: array(code) for name, code in SECTIONS.items()}
+    tags = {}
+    orders = {}
+    tag_positions = []
+    arrays["tag_start"].append(0)
+    arrays["id_start"].append(0)
+    arrays["body_start"].append(0)
+
+    for pos, question in enumerate(questions):
+        for key in ("difficulty", "frequency"):
+            kind = number_kind(question, key)
+            arrays[key].append(getattr(question, key) or 0)
+            arrays[f"{key}_kind"].append(kind)
+
+        if not isinstance(question.scaffold, bool) or not isinstance(
+            question.autotag, bool
+        ):
+            raise ValueError(
+                f"question {question.id}: scaffold and autotag have to be booleans"
+            )
+        flags = FLAG_SCAFFOLD * question.scaffold + FLAG_AUTOTAG * question.autotag
+
+        if question.source is not None:
+            # same text as the spans of load_metadata_all (without BOM)
+            source_file, start, end = question.source
+            body = read_source(source_file)[start:end].encode("utf-8")
+        else:
+            body = pickle.dumps(question.fields, pickle.HIGHEST_PROTOCOL)
+            flags |= FLAG_PICKLED
+        arrays["flags"].append(flags)
+        arrays["bodies"].frombytes(body)
+        arrays["body_start"].append(len(arrays["bodies"]))
+
+        for key in question.order:
+            check_json(key, f"question {question.id}: key")
+        arrays["order"].append(orders.setdefault(question.order, len(orders)))
+
+        for tag in question.tags:
+            check_json(tag, f"question {question.id}: tag")
+            if tag not in tags:
+                tags[tag] = len(tags)
+                tag_positions.append([])
+            arrays["tag_ids"].append(tags[tag])
+            tag_positions[tags[tag]].append(pos)
+        arrays["tag_start"].append(len(arrays["tag_ids"]))
+
+        arrays["ids"].frombytes(question.id.encode("utf-8"))
+        arrays["id_start"].append(len(arrays["ids"]))
+
+    bitset_size = len(questions) // 8 + 1
+    for positions in tag_positions:
+        bitset = bytearray(bitset_size)
+        for pos in positions:
+            bitset[pos >> 3] |= 1 << (pos & 7)
+        arrays["bitsets"].frombytes(bitset)
+
+    sections = {}
+    offset = 0
+    for name, values in arrays.items():
+        sections[name] = [offset, len(values)]
+        offset += -(-len(values) * values.itemsize // ALIGNMENT) * ALIGNMENT
+
+    header = json.dumps(
+        {
+            "version": INDEX_VERSION,
+            "byteorder": sys.byteorder,
+            "count": len(questions),
+            "files": files_signature,
+            "tags": list(tags),
+            "orders": list(orders),
+            "bitset_size": bitset_size,
+            "sections": sections,
+        },
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+    # a temporary file for each writer, as BankCache.save
+    tmp_name = None
+    try:
+        with tempfile.NamedTemporaryFile(
+            "wb", dir=path.parent, prefix=f"{path.name}.", suffix=".tmp", delete=False
+        ) as fh:
+            tmp_name = fh.name
+            fh.write(MAGIC)
+            fh.write(struct.pack("<Q", len(header)))
+            fh.write(header)
+            fh.write(bytes(-fh.tell() % ALIGNMENT))
+            for values in arrays.values():
+                fh.write(values.tobytes())
+                fh.write(bytes(-fh.tell() % ALIGNMENT))
+        replace_file(tmp_name, path)
+    except BaseException:
+        if tmp_name is not None:
+            Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+
+class MappedBank(Sequence):
+    """
+    Questions of a bank read from its index file (mmap).
+
+    It is used as the list of questions of load_questions: the questions
+    (MappedQuestion) are created from the arrays the first time they are
+    accessed, and their bodies are decoded when they are rendered. Pickled
+    (process pools), only the path is sent and the file is mapped again.
+
+    attributes:
+        path: index file
+        header: header of the file (json)
+        count: number of questions
+        tags: tag of each tag number (interned)
+        orders: keys of the questions, by order number
+        sections: name -> memoryview of the array
+        questions: questions already created (None if not yet)
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        with path.open("rb") as fh:
+            self.map = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.map[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not an index of a bank")
+        (header_size,) = struct.unpack_from("<Q", self.map, len(MAGIC))
+        start = len(MAGIC) + 8
+        self.header = json.loads(self.map[start : start + header_size])
+        if self.header["version"] != INDEX_VERSION:
+            raise ValueError(f"old version {self.header['version']}")
+        if self.header["byteorder"] != sys.byteorder:
+            raise ValueError(f"written in a {self.header['byteorder']} endian machine")
+
+        self.count = self.header["count"]
+        self.tags = [
+            sys.intern(tag) if isinstance(tag, str) else tag
+            for tag in self.header["tags"]
+        ]
+        self.orders = [
+            tuple(sys.intern(key) if isinstance(key, str) else key for key in order)
+            for order in self.header["orders"]
+        ]
+
+        base = start + header_size
+        base += -base % ALIGNMENT
+        view = memoryview(self.map)
+        self.sections = {}
+        for name, (offset, length) in self.header["sections"].items():
+            code = SECTIONS[name]
+            size = length * array(code).itemsize
+            self.sections[name] = view[base + offset : base + offset + size].cast(code)
+
+        self.questions = [None] * self.count
+
+    def __reduce__(self):
+        return open_bank, (str(self.path),)
+
+    def is_fresh(self, files: List[Path]) -> bool:
+        """
+        The index has the same files (and versions of them) as files
+        """
+        return self.header["files"] == signatures(files)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, pos):
+        if isinstance(pos, slice):
+            return [self[item] for item in range(*pos.indices(self.count))]
+        if pos < 0:
+            pos += self.count
+        if not 0 <= pos < self.count:
+            raise IndexError("question index out of range")
+
+        question = self.questions[pos]
+        if question is None:
+            question = self.questions[pos] = MappedQuestion(self, pos)
+        return question
+
+    def __iter__(self):
+        return (self[pos] for pos in range(self.count))
+
+    def number(self, key: str, pos: int):
+        """
+        Value of difficulty or frequency of question pos
+        """
+        kind = self.sections[f"{key}_kind"][pos]
+        if kind == KIND_NONE:
+            return None
+        value = self.sections[key][pos]
+        if kind == KIND_INT:
+            return int(value)
+        return value
+
+    def text(self, name: str, pos: int) -> bytes:
+        """
+        Bytes of question pos in a blob section (see BLOBS)
+        """
+        starts = self.sections[BLOBS[name]]
+        return self.sections[name][starts[pos] : starts[pos + 1]].tobytes()
+
+    def bitsets(self) -> Dict:
+        """
+        tag -> int with the bits of the questions with the tag (see TagIndex)
+        """
+        size = self.header["bitset_size"]
+        data = self.sections["bitsets"]
+        return {
+            tag: int.from_bytes(data[number * size : (number + 1) * size], "little")
+            for number, tag in enumerate(self.tags)
+        }
+
+
+@lru_cache(maxsize=None)
+def open_bank(path: str) -> MappedBank:
+    """
+    Bank mapped from path (once for each process)
+    """
+    return MappedBank(Path(path))
+
+
+@lru_cache(maxsize=256)
+def load_body(bank: MappedBank, pos: int) -> Dict:
+    """
+    Fields of question pos of bank. The dict is shared, do not modify it.
+    """
+    body = bank.text("bodies", pos)
+    if bank.sections["flags"][pos] & FLAG_PICKLED:
+        return pickle.loads(body)
+
+    return safe_load(body.decode("utf-8"))
+
+
+class MappedQuestion(Question):
+    """
+    Question of a MappedBank. The metadata is read from the arrays of the
+    bank and the fields from its yaml document when they are needed.
+
+    attributes (besides the ones of Question):
+        bank: MappedBank of the question
+        pos: position of the question in bank
+    """
+
+    __slots__ = ("bank", "pos")
+
+    # pylint: disable=super-init-not-called
+    def __init__(self, bank: MappedBank, pos: int):
+        sections = bank.sections
+        start, end = sections["tag_start"][pos], sections["tag_start"][pos + 1]
+        flags = sections["flags"][pos]
+
+        self.bank = bank
+        self.pos = pos
+        self.id = sys.intern(bank.text("ids", pos).decode("utf-8"))
+        self.difficulty = bank.number("difficulty", pos)
+        self.frequency = bank.number("frequency", pos)
+        self.scaffold = bool(flags & FLAG_SCAFFOLD)
+        self.autotag = bool(flags & FLAG_AUTOTAG)
+        self.tags = tuple(bank.tags[tag] for tag in sections["tag_ids"][start:end])
+        self.order = bank.orders[sections["order"][pos]]
+        self.source = None
+        self.fields = None
+
+    def body(self) -> Dict:
+        if self.fields is None:
+            return load_body(self.bank, self.pos)
+        return self.fields
+
+
+def load_index(bank: Path, files: List[Path]) -> Optional[MappedBank]:
+    """
+    Mapped index of bank if it exists and it is up to date with files
+    """
+    path = index_filename(bank)
+    if not path.exists():
+        return None
+
+    try:
+        mapped = open_bank(str(path.resolve()))
+    except Exception as exc:  # pylint: disable=broad-except
+        log.warning("index %s ignored: %s", path, exc)
+        return None
+
+    if not mapped.is_fresh(files):
+        log.warning(
+            "index %s is out of date (run: rand-exam.py index %s)", path, bank
+        )
+        return None
+
+    return mapped
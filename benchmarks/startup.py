@@ -0,0 +1,90 @@
+"""
+Check the startup time of rand-exam.py: the imports of its own modules
+(measured with python -X importtime) must stay under a budget. The time of
+the whole command is shown too; most of it is typer (and rich, when it is
+installed), which is not counted in the budget.
+
+    python benchmarks/startup.py [BUDGET_MS] [RUNS]
+
+Exit status 1 if the median of the imports is over BUDGET_MS (30 ms).
+"""
+
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+SCRIPT = Path(__file__).resolve().parent.parent / "rand-exam.py"
+
+# modules of rand-exam imported at startup
+MODULES = {
+    "yaml_loader",
+    "macro_engine2",
+    "tags",
+    "counter",
+    "bank_cache",
+    "bank_index",
+    "sampler",
+    "ledger",
+    "question",
+}
+
+
+def startup(command):
+    """
+    (seconds of the whole command, ms importing MODULES, ms importing typer)
+    """
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", str(SCRIPT), *command],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    elapsed = time.perf_counter() - start
+
+    own = typer = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        # import time: self [us] | cumulative | imported package
+        _self, cumulative, name = line[len("import time:") :].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        # only the modules imported by rand-exam.py itself (not nested)
+        if name.startswith("  "):
+            continue
+        name = name.strip()
+        if name in MODULES:
+            own += int(cumulative)
+        elif name == "typer":
+            typer += int(cumulative)
+
+    return elapsed, own / 1000, typer / 1000
+
+
+def main():
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else 30
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 7
+
+    failed = False
+    for command in (["--list-ops"], ["--help"]):
+        samples = [startup(command) for _ in range(runs)]
+        elapsed = statistics.median(it[0] for it in samples)
+        own = statistics.median(it[1] for it in samples)
+        typer = statistics.median(it[2] for it in samples)
+        print(
+            f"rand-exam.py {' '.join(command)}: {elapsed * 1000:.0f} ms, "
+            f"own modules {own:.0f} ms (budget {budget:.0f} ms), "
+            f"typer {typer:.0f} ms"
+        )
+        failed = failed or own > budget
+
+    if failed:
+        print("over budget")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
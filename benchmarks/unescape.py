@@ -0,0 +1,59 @@
+"""
+Compare macro_engine2.unescape with the previous char by char loop over a
+LaTeX-like field.
+
+    python benchmarks/unescape.py [SIZE]
+"""
+
+import sys
+import time
+from pathlib import Path
+
+# the modules of rand-exam are in the parent directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from macro_engine2 import unescape  # pylint: disable=wrong-import-position
+
+
+def unescape_loop(text: str) -> str:
+    """
+    unescape as it was before the regex (char by char)
+    """
+    output = ""
+    scape = False
+    for char in text:
+        if scape:
+            if char in "\\(),":
+                output += char
+            else:
+                output += f"\\{char}"
+            scape = False
+        else:
+            if char == "\\":
+                scape = True
+            else:
+                output += char
+
+    return output
+
+
+def benchmark_unescape(size: int = 1_000_000):
+    """
+    Time both versions over a field of size chars
+    """
+    chunk = (
+        "\\begin{enunciado} Calcula \\textbf{la} fase $\\frac{1}{2}\\pi$ en "
+        "\\SI{3}{\\hertz}, con \\(x\\) y un 50\\% de error.\n\\end{enunciado}\n"
+    )
+    text = chunk * (size // len(chunk) + 1)
+
+    for name, function in [("loop", unescape_loop), ("regex", unescape)]:
+        start = time.perf_counter()
+        output = function(text)
+        print(f"{name}: {time.perf_counter() - start:.3f} s")
+
+    assert output == unescape_loop(text)
+
+
+if __name__ == "__main__":
+    benchmark_unescape(*[int(arg) for arg in sys.argv[1:2]])
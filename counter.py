@@ -3,24 +3,30 @@
 Class to count number of questions
 """
 
+import logging
 import random
 import re
 
 from typing import List
-import yaml
 
 import tags
+from sampler import AliasSampler
+from yaml_loader import safe_load
 
+log = logging.getLogger(__name__)
 
-def find_questions(structure, questions) -> List:
+
+def find_questions(structure, questions: tags.TagIndex) -> List:
     """
     find_questions to test
+
+    questions is the TagIndex of the bank of questions
     """
     query = tags.tag_query(structure)
 
     # print("fake finding", structure)
     # return list(structure)  # TODO: delete this line
-    return tags.look_compatible_questions(query, questions)
+    return questions.look_compatible_questions(query)
 
 
 class Counter:
@@ -34,6 +40,8 @@ class Counter:
         min: min number of questions can be choosen
         max: max number of questions can be choosen
         taken: final number of questions taken
+        sampler: AliasSampler of bank (see build_samplers)
+        node_id: position of the node in the taken list of an attempt
     """
 
     def __init__(self, structure, questions):
@@ -43,6 +51,8 @@ class Counter:
         self.min = 0
         self.max = 0
         self.taken = 0
+        self.sampler = None
+        self.node_id = 0
 
         if isinstance(structure, int):
             self._init_int(structure)
@@ -145,7 +155,7 @@ class Counter:
             self.min = 1
             self.max = 1
         else:
-            print(questions)
+            log.debug("%s", questions.questions)
             raise ValueError(
                 f"""
 Lemma: <{self.lemma}> doesn't have any question in question_bank
@@ -285,12 +295,20 @@ an empty range was obtained
         self.max += other.max
 
     def __str__(self):
+        return self.to_str()
+
+    def to_str(self, taken=None) -> str:
+        """
+        Representation of the tree. If taken is given (see new_taken), it
+        is used instead of the attribute taken.
+        """
+        current = self.taken if taken is None else taken[self.node_id]
         output = [
             f"Counter: {self.lemma}",
-            f"  range: [{self.min}:{self.max}] -> {self.taken}",
+            f"  range: [{self.min}:{self.max}] -> {current}",
         ]
         for child in self.children:
-            lines = str(child).split("\n")
+            lines = child.to_str(taken).split("\n")
             for line in lines:
                 output.append(f"  {line}")
 
@@ -299,17 +317,17 @@ an empty range was obtained
 
         return "\n".join(output)
 
-    def have_to_grow(self) -> bool:
+    def have_to_grow(self, taken) -> bool:
         """
         Inform if the counter have to increase its taken value because is less than minimum
         """
-        return self.taken < self.min
+        return taken[self.node_id] < self.min
 
-    def can_grow(self) -> bool:
+    def can_grow(self, taken) -> bool:
         """
         Inform if the counter can increase its value
         """
-        return self.taken < self.max
+        return taken[self.node_id] < self.max
 
     def is_single(self) -> bool:
         """
@@ -327,9 +345,9 @@ an empty range was obtained
 
         if bool(self.children) == bool(self.bank):
             if not self.children:
-                print(f"\n{self} don't have children neither bank of questions")
+                log.error("%s don't have children neither bank of questions", self)
             else:
-                print(f"\n{self} have children and bank of questions")
+                log.error("%s have children and bank of questions", self)
             return False
 
         if self.children:
@@ -339,41 +357,94 @@ an empty range was obtained
 
         return True
 
+    def build_samplers(self, samplers=None):
+        """
+        Build an AliasSampler for the bank of every leaf of the tree.
+        Leaves with the same bank share the sampler.
+        """
+        if samplers is None:
+            samplers = {}
+
+        if self.bank:
+            key = id(self.bank)
+            if key not in samplers:
+                samplers[key] = AliasSampler(
+                    [question.frequency for question in self.bank]
+                )
+            self.sampler = samplers[key]
+
+        for child in self.children:
+            child.build_samplers(samplers)
+
+    def nodes(self) -> List:
+        """
+        List of the nodes of the tree (preorder, the order of node_id)
+        """
+        output = [self]
+        for child in self.children:
+            output.extend(child.nodes())
+
+        return output
+
+    def number_nodes(self, next_id: int = 0) -> int:
+        """
+        Assign node_id to the nodes of the tree (preorder).
+        Return the next id free (the number of nodes for the root)
+        """
+        self.node_id = next_id
+        next_id += 1
+        for child in self.children:
+            next_id = child.number_nodes(next_id)
+
+        return next_id
+
+    def new_taken(self) -> List[int]:
+        """
+        Return the state of an attempt: the questions taken by each node,
+        indexed by node_id. The tree is not modified by the attempts, so it
+        is shared by all of them.
+        """
+        return [0] * self.number_nodes()
+
     # variation of question taken
-    def increment_question(self):
+    def increment_question(self, taken: List[int]):
         """
         Increment the number of real questions of the counter
         """
-        assert self.can_grow()
+        assert self.can_grow(taken)
 
-        self.taken += 1
+        taken[self.node_id] += 1
 
         if self.bank:
             return
 
         # locate have to grow
         haveto = [
-            pos for (pos, counter) in enumerate(self.children) if counter.have_to_grow()
+            pos
+            for (pos, counter) in enumerate(self.children)
+            if counter.have_to_grow(taken)
         ]
         if haveto:
             to_grow = haveto.pop()
-            self.children[to_grow].increment_question()
+            self.children[to_grow].increment_question(taken)
             return
 
         # locate growable children
         growable = [
-            pos for (pos, counter) in enumerate(self.children) if counter.can_grow()
+            pos
+            for (pos, counter) in enumerate(self.children)
+            if counter.can_grow(taken)
         ]
         to_grow = random.choice(growable)
 
-        self.children[to_grow].increment_question()
+        self.children[to_grow].increment_question(taken)
 
-    def update_taken_questions(self, amount: int):
+    def update_taken_questions(self, amount: int, taken: List[int]):
         """
         Increment questions until the amount
         """
-        while self.taken < amount:
-            self.increment_question()
+        while taken[self.node_id] < amount:
+            self.increment_question(taken)
 
 
 def main():
@@ -397,12 +468,14 @@ def main():
             tres: 1-2
     """
 
-    source = yaml.safe_load(document)
+    import yaml  # pylint: disable=import-outside-toplevel
+
+    source = safe_load(document)
     print(yaml.safe_dump(source))
     print((source))
 
     questions = []
-    c = Counter(source, questions)
+    c = Counter(source, tags.TagIndex(questions))
     print(c)
 
 
@@ -0,0 +1,102 @@
+"""
+Ledger of the questions used in the editions of an exam
+"""
+
+import json
+import tempfile
+from pathlib import Path
+from typing import List, Set
+
+from replace_file import replace_file
+
+
+def ledger_filename(index_file: Path) -> Path:
+    """
+    Filename of the ledger of an index file (same directory)
+    """
+    return index_file.with_name(f"{index_file.stem}.ledger.json")
+
+
+class Ledger:
+    """
+    Usage of the questions along the editions of an exam.
+
+    It is loaded once, updated in memory with every edition generated and
+    written with save at the end.
+
+    attributes:
+        path: file with the ledger (json)
+        entries: question id -> [times used, last edition used]
+        dirty: the ledger has to be written
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.entries = {}
+        self.dirty = False
+
+        if self.path.exists():
+            with self.path.open("r") as fh:
+                self.entries = json.load(fh)
+
+    def excluded(self, edition: int, recent: int) -> Set[str]:
+        """
+        Questions used in the previous recent editions (edition-recent ..
+        edition-1), according to the last edition they were used.
+        """
+        return {
+            question_id
+            for question_id, (_count, last) in self.entries.items()
+            if edition - recent <= last < edition
+        }
+
+    def least_recent(self, question_ids) -> List[str]:
+        """
+        question_ids sorted from the least recently used (and, for the same
+        edition, the least used)
+        """
+        return sorted(
+            question_ids,
+            key=lambda question_id: (
+                self.entries.get(question_id, (0, -1))[1],
+                self.entries.get(question_id, (0, -1))[0],
+                question_id,
+            ),
+        )
+
+    def record(self, question_ids: List[str], edition: int):
+        """
+        Add the questions used in edition
+        """
+        for question_id in question_ids:
+            count, last = self.entries.get(question_id, (0, edition))
+            self.entries[question_id] = [count + 1, max(last, edition)]
+
+        self.dirty = True
+
+    def save(self):
+        """
+        Write the ledger if it changed
+        """
+        if not self.dirty:
+            return
+
+        # a temporary file for each writer, so parallel runs don't mix them
+        tmp_name = None
+        try:
+            with tempfile.NamedTemporaryFile(
+                "w",
+                dir=self.path.parent,
+                prefix=f"{self.path.name}.",
+                suffix=".tmp",
+                delete=False,
+            ) as fh:
+                tmp_name = fh.name
+                json.dump(self.entries, fh, separators=(",", ":"))
+            replace_file(tmp_name, self.path)
+        except BaseException:
+            if tmp_name is not None:
+                Path(tmp_name).unlink(missing_ok=True)
+            raise
+
+        self.dirty = False
@@ -1,8 +1,18 @@
+from functools import lru_cache
 from typing import Tuple, Mapping, List
+import logging
+import math
+import operator
 import time
 import random
 import re
 
+log = logging.getLogger(__name__)
+
+
+START_PATTERN = re.compile(r"\(\((?!\()", re.DOTALL)
+END_PATTERN = re.compile(r"\)\)", re.DOTALL)
+
 
 def locate_macro(text: str) -> Tuple[str, str, str]:
     """
@@ -10,30 +20,25 @@ def locate_macro(text: str) -> Tuple[str, str, str]:
     return the text in 3 parts: previous, macro invocation, rest
 
     """
-    start_pattern = re.compile(r"\(\((?!\()", re.DOTALL)
-    end_pattern = re.compile(r"\)\)", re.DOTALL)
-
-    start1 = start_pattern.search(text)
-    if start1 is None:
+    start = START_PATTERN.search(text)
+    if start is None:
         return (text, "", "")
 
-    previous = text[: start1.start()]
-    following = text[start1.end() :]
+    # move to the next opening while it is before the closing
+    while True:
+        end = END_PATTERN.search(text, start.end())
 
-    start2 = start_pattern.search(following)
-    end2 = end_pattern.search(following)
+        if end is None:
+            raise ValueError(f"Opened macro, never closed: <{text[start.end():]}>")
 
-    if end2 is None:
-        raise ValueError(f"Opened macro, never closed: <{following}>")
-
-    if start2 and start2.start() < end2.start():
-        p2, m2, po2 = locate_macro(following)
-        return (previous + "((" + p2, m2, po2)
+        nested = START_PATTERN.search(text, start.end())
+        if nested is None or nested.start() > end.start():
+            break
+        start = nested
 
-    # end2.start() < start2.start()
-    # or start2 is None
-    macro = following[: end2.start()]
-    post = following[end2.end() :]
+    previous = text[: start.start()]
+    macro = text[start.end() : end.start()]
+    post = text[end.end() :]
     return (previous, macro, post)
 
 
@@ -220,8 +225,7 @@ def op_OPEXCEPT(args, vars_storage: Mapping) -> Tuple[str, Mapping]:
     num_except = int(args.pop(0))
     excepts = []
 
-    print("\nnum_except", num_except)
-    print("type", type(num_except))
+    log.debug("num_except %s", num_except)
 
     for _it in range(num_except):
         excepts.append(args.pop(0))
@@ -295,54 +299,108 @@ def op_QUOTECOMMA(args, vars_storage: Mapping) -> Tuple[str, Mapping]:
     # mathematical operations
 
 
+def calc_unary(function):
+    """
+    CALC operation applied to the top of the stack
+    """
+
+    def operation(stack):
+        stack.append(function(stack.pop()))
+
+    return operation
+
+
+def calc_binary(function):
+    """
+    CALC operation applied to the two values in the top of the stack (the top
+    is the second operand)
+    """
+
+    def operation(stack):
+        value_b = stack.pop()
+        value_a = stack.pop()
+        stack.append(function(value_a, value_b))
+
+    return operation
+
+
+def calc_round(stack):
+    decimals = int(stack.pop())
+    value = stack.pop()
+    stack.append(round(value, decimals))
+
+
+CALC_OPERATIONS = {
+    "INT": calc_unary(lambda value: int(round(value))),  # round to even, then cast
+    "ROUND": calc_round,
+    "+": calc_binary(operator.add),
+    "-": calc_binary(operator.sub),
+    "*": calc_binary(operator.mul),
+    "/": calc_binary(operator.truediv),
+    "^": calc_binary(operator.pow),
+    "sqrt": calc_unary(math.sqrt),
+    "sin": calc_unary(math.sin),
+    "cos": calc_unary(math.cos),
+    "log": calc_unary(math.log),
+}
+
+
+@lru_cache(maxsize=1024)
+def compile_calc(args: Tuple[str, ...]) -> Tuple:
+    """
+    Program of a CALC: for each arg (token, operation, number).
+
+    Operations and numbers are resolved once. Any token can be a variable, so
+    that is checked when the program is run.
+    """
+    program = []
+    for arg in args:
+        token = arg.strip()
+        operation = CALC_OPERATIONS.get(token)
+        number = None
+        if operation is None and token:
+            try:
+                number = float(token)
+            except ValueError:
+                pass
+        program.append((token, operation, number))
+
+    return tuple(program)
+
+
 @register_op("CALC")
 def op_CALC(args, vars_storage) -> Tuple[str, Mapping]:
-    full_calculation = " ".join(args)
     stack = []
+    metadata = vars_storage["metadata"]
 
     try:
-        while args:
-            print(f"CALC args: {args}")
-            key = args.pop(0).strip()
-
+        for token, operation, number in compile_calc(tuple(args)):
             # Variable substitution
-            if key in vars_storage["metadata"]:
-                key = vars_storage["metadata"][key]
-            elif key in vars_storage:
-                key = vars_storage[key]
-
-            # Remove empty operator
-            if key == "":
-                continue
-
-            # Operators
-            if key == "INT":
-                value = stack.pop()
-                stack.append(int(round(value)))  # round to even, then cast
-            elif key == "ROUND":
-                decimals = int(stack.pop())
-                value = stack.pop()
-                stack.append(round(value, decimals))
-            elif key == "+":
-                value_b = stack.pop()
-                value_a = stack.pop()
-                stack.append(value_a + value_b)
-            elif key == "-":
-                value_b = stack.pop()
-                value_a = stack.pop()
-                stack.append(value_a - value_b)
-            elif key == "*":
-                value_b = stack.pop()
-                value_a = stack.pop()
-                stack.append(value_a * value_b)
-            elif key == "/":
-                value_b = stack.pop()
-                value_a = stack.pop()
-                stack.append(value_a / value_b)
-            else:
-                stack.append(float(key))
+            if token in metadata or token in vars_storage:
+                if token in metadata:
+                    key = metadata[token]
+                else:
+                    key = vars_storage[token]
+
+                # Remove empty operator
+                if key == "":
+                    continue
+
+                operation = None
+                if isinstance(key, str):
+                    operation = CALC_OPERATIONS.get(key)
+                if operation is None:
+                    number = float(key)
+
+            if operation is not None:
+                operation(stack)
+            elif number is not None:
+                stack.append(number)
+            elif token:
+                # not a number: same error as float()
+                stack.append(float(token))
     except IndexError as exc:
-        print(f"\nERROR in CALC -> Args: {full_calculation}")
+        log.error("ERROR in CALC -> Args: %s", " ".join(args))
         raise IndexError from exc
 
     if len(stack) > 1:
@@ -360,9 +418,6 @@ def print_operations():
         print(" ", it)
 
 
-print_operations()
-
-
 # --------------------------------------------------------------------
 # Macro engine
 def run_function(key, *args, vars_storage, macros={}) -> Tuple[str, Mapping]:
@@ -370,7 +425,6 @@ def run_function(key, *args, vars_storage, macros={}) -> Tuple[str, Mapping]:
     Execute function "key" with arguments
     """
 
-    print("RUN_FUNCTION:", key, ",".join(args), end=" --> ")
     text = None
 
     # metadata
@@ -389,11 +443,49 @@ def run_function(key, *args, vars_storage, macros={}) -> Tuple[str, Mapping]:
     elif key in internal_operations:
         text, vars_storage = internal_operations[key](list(args), vars_storage)
 
-    print(text)
+    log.debug("RUN_FUNCTION: %s %s --> %s", key, args, text)
 
     return text, vars_storage
 
 
+# Escapes of the macro engine: a backslash and one of ESCAPED_CHARS. The args
+# of a macro are split by the commas not escaped and the escapes left in the
+# output are replaced by the char at the end. A backslash before other chars
+# is kept and a backslash at the end of the text is removed.
+ESCAPED_CHARS = "\\(),"
+ESCAPE_PATTERN = re.compile(r"\\([\\(),]|\Z)")
+ARG_PATTERN = re.compile(ESCAPE_PATTERN.pattern + "|,")
+
+
+def split_macro(macro: str) -> Tuple[str, List[str]]:
+    """
+    Split the text of a macro invocation (without parentheses) in its name
+    and its args
+
+    if the text has "\\,", the comma isn't used as split of args (and the
+    backslash is removed). Other escapes are kept for unescape.
+    """
+    if "\\" not in macro:
+        args = macro.split(",")
+    else:
+        args = [""]
+        position = 0
+        for match in ARG_PATTERN.finditer(macro):
+            args[-1] += macro[position : match.start()]
+            if match[0] == ",":
+                args.append("")
+            elif match[0] == "\\,":
+                args[-1] += ","
+            else:
+                args[-1] += match[0]
+            position = match.end()
+        args[-1] += macro[position:]
+
+    key = args.pop(0)
+
+    return key, args
+
+
 def load_next_macro(text: str) -> Tuple:
     """
     Load next macro and return a tuple with all elements to process
@@ -412,31 +504,61 @@ def load_next_macro(text: str) -> Tuple:
     if not macro:
         return (previous, "", [], "")
 
-    args = macro.split(",")
+    key, args = split_macro(macro)
 
-    # escape of comma
-    nargs = []
-    escaped_comma = False
-    for arg in args:
-        if escaped_comma:
-            nargs[-1] = nargs[-1][0:-1] + ","
-            nargs[-1] += arg
-        else:
-            nargs.append(arg)
+    return (previous, key, args, post)
 
-        if len(arg) > 0:
-            escaped_comma = arg[-1] == "\\"
-        else:
-            escaped_comma = False
 
-    args = nargs
+def unescape(text: str) -> str:
+    """
+    Remove the escape chars of the text already expanded
+    """
+    if "\\" not in text:
+        return text
+
+    return ESCAPE_PATTERN.sub(r"\1", text)
 
-    key = args.pop(0)
 
-    return (previous, key, args, post)
+# runs of "(", runs of ")" and the text between them
+TOKEN_PATTERN = re.compile(r"\(+|\)+|[^()]+")
 
 
-def macro_engine2_single(macros, vars_storage, text) -> str:
+@lru_cache(maxsize=4096)
+def compile_template(text: str) -> Tuple[str, ...]:
+    """
+    Split a text in the tokens used by the macro engine.
+
+    The templates (fields of the questions, headers and footers) are the same
+    in every edition, so the tokens are cached by text.
+    """
+    return tuple(TOKEN_PATTERN.findall(text))
+
+
+def drop_to_newline(pending: List[List]):
+    """
+    Remove the pending input until the next newline (inclusive), used by DNL
+    """
+    while pending:
+        source = pending[-1]
+        tokens = source[0]
+        for index in range(source[1], len(tokens)):
+            newline = tokens[index].find("\n")
+            if newline >= 0:
+                source[1] = index + 1
+                rest = tokens[index][newline + 1 :]
+                if rest:
+                    pending.append([(rest,), 0, source[2]])
+                return
+        pending.pop()
+
+
+# maximum number of macros expanded in one text
+MAX_EXPANSIONS = 100000
+
+
+def macro_engine2_single(
+    macros, vars_storage, text, max_expansions=MAX_EXPANSIONS
+) -> str:
     r"""
      In this engine, the activation of a macro is always in the shape:
          ((name,args,args,...))
@@ -457,42 +579,193 @@ def macro_engine2_single(macros, vars_storage, text) -> str:
 
       the close parentheses is not always required. depend on the context
 
-    """
-    previous, key, args, post = load_next_macro(text)
-    if not key:
-        # unscaping
-        output = ""
-        scape = False
-        for char in previous:
-            if scape:
-                if char in "\\(),":
-                    output += char
-                else:
-                    output += f"\\{char}"
-                scape = False
+    The text is read once as a stream of tokens (compile_template). Every
+    "((" opens a level and every "))" closes the innermost one and calls the
+    macro. The result is pushed back in front of the pending input, so it is
+    expanded again, as if it was written in place of the invocation.
+
+    In a run of "(" the last two open the macro and in a run of ")" the first
+    two close it; the rest are plain text. Runs are joined across the
+    boundaries of the results, as they would be in the substituted text.
+
+    There is no recursion, so the size of the text and the number of macros
+    are only limited by max_expansions (macros expanded in the text). A user
+    macro invoked again from its own result is an error (it never ends).
+    """
+    # input not read yet: stack of [tokens, position, user macros that
+    # generated the tokens], top is read first
+    pending = [[compile_template(text), 0, ()]]
+    # macros opened: [text, user macros that generated the "(("], levels[0]
+    # is the output
+    levels = [[[], ()]]
+    expansions = 0
+
+    while pending:
+        source = pending[-1]
+        tokens, position, chain = source
+        if position >= len(tokens):
+            pending.pop()
+            continue
+
+        token = tokens[position]
+        source[1] = position + 1
+        first = token[0]
+
+        if first != "(" and first != ")":
+            levels[-1][0].append(token)
+            continue
+
+        # join the run with the runs of the same char in the next inputs
+        run = len(token)
+        while True:
+            while pending and pending[-1][1] >= len(pending[-1][0]):
+                pending.pop()
+            if not pending:
+                break
+            following = pending[-1]
+            next_token = following[0][following[1]]
+            if next_token[0] != first:
+                break
+            run += len(next_token)
+            following[1] += 1
+
+        level = levels[-1][0]
+        if first == "(":
+            if run == 1:
+                level.append("(")
             else:
-                if char == "\\":
-                    scape = True
-                else:
-                    output += char
+                if run > 2:
+                    level.append("(" * (run - 2))
+                # the macro belongs to the input where it is opened
+                levels.append([[], chain])
+            continue
+
+        if len(levels) == 1 or run == 1:
+            level.append(")" * run)
+            continue
+
+        # close macro
+        _, opened_chain = levels.pop()
+        key, args = split_macro("".join(level))
+
+        if not key:
+            # an empty macro ends the processing: the text after it is lost
+            return unescape("((".join("".join(it) for it, _ in levels))
+
+        expansions += 1
+        if expansions > max_expansions:
+            raise ValueError(
+                f"More than {max_expansions} macros expanded, last one <{key}>"
+            )
+
+        if run > 2:
+            pending.append([(")" * (run - 2),), 0, chain])
+
+        # DNL, remove from macro invocation to newline inclusive
+        if key == "DNL":
+            drop_to_newline(pending)
+        else:
+            # same precedence as run_function: metadata, vars, user macros
+            user_macro = (
+                key in macros
+                and key not in vars_storage["metadata"]
+                and key not in vars_storage
+            )
+            if user_macro:
+                if key in opened_chain:
+                    cycle = " -> ".join(
+                        opened_chain[opened_chain.index(key) :] + (key,)
+                    )
+                    raise ValueError(f"Recursive macro: {cycle}")
+                result_chain = opened_chain + (key,)
+            else:
+                result_chain = opened_chain
+
+            # execute function in key
+            result, vars_storage = run_function(
+                key, *args, vars_storage=vars_storage, macros=macros
+            )
+            if result is None:
+                raise ValueError("~~~~~~~~Unknown function", key, args)
+            pending.append([compile_template(result), 0, result_chain])
+
+        # a run of parentheses before the macro is read again with the text
+        # that follows it now
+        parent, parent_chain = levels[-1]
+        if parent and parent[-1][0] in "()":
+            pending.append([(parent.pop(),), 0, parent_chain])
+
+    if len(levels) > 1:
+        following = "((".join("".join(it) for it, _ in levels[1:])
+        raise ValueError(f"Opened macro, never closed: <{following}>")
 
-        return output
+    return unescape("".join(levels[0][0]))
 
-    # DNL, remove from macro invocation to newline inclusive
-    if key == "DNL":
-        post = remove_to_nl(post)
-        text = previous + post
-        return macro_engine2_single(macros, vars_storage, text)
 
-    # execute function in key
-    result, vars_storage = run_function(
-        key, *args, vars_storage=vars_storage, macros=macros
-    )
-    if result is not None:
-        text = previous + result + post
-        return macro_engine2_single(macros, vars_storage, text)
+def build_macro_table(macros: List[Mapping]) -> Mapping:
+    """
+    Table of user macros by name from the output of load_macros
+    """
+    macros2 = {}
+    for it in macros:
+        output = {}
+        key = it["key"]
+        output["constant"] = it["constant"]
+        output["value"] = it["value"]
+        if "args" in it:
+            output["args"] = it["args"]
+
+        macros2[key] = output
+
+    return macros2
+
+
+class MacroEngine:
+    """
+    Macro engine of an exam, built once with the macros of the index file and
+    used for the headers, the questions and the footers of every edition.
 
-    raise ValueError("~~~~~~~~Unknown function", key, args)
+    attributes:
+        macros: user macros by name (see build_macro_table)
+        max_expansions: maximum number of macros expanded in one text
+    """
+
+    def __init__(self, macros: List[Mapping], max_expansions=MAX_EXPANSIONS):
+        self.macros = build_macro_table(macros)
+        self.max_expansions = max_expansions
+
+    def expand(self, vars_storage, text) -> str:
+        """
+        Expand all the macros of text (see macro_engine2_single)
+        """
+        return macro_engine2_single(
+            self.macros, vars_storage, text, self.max_expansions
+        )
+
+    def render(self, counter, vars_storage, files_id, texts) -> List[str]:
+        """
+        Process a list of texts with same macro and vars definitions (see
+        macro_engine2)
+        """
+        output_texts = []
+        # updating data to engine2
+        # copy to avoid the manipulation of original data in macro_engine2
+        vars_storage2 = dict(vars_storage.items())
+        vars_storage2["metadata"]["COUNTER"] = counter
+
+        # calling for each part
+        for file_id, text in zip(files_id, texts):
+            vars_storage2["metadata"]["FILE"] = file_id
+            # cache of the original text un processed
+            if file_id in vars_storage2["metadata"]:
+                vars_storage2["metadata"][f"{file_id}_raw"] = vars_storage2[
+                    "metadata"
+                ][file_id]
+            # cache of processed text
+            vars_storage2["metadata"][file_id] = self.expand(vars_storage2, text)
+            output_texts.append(vars_storage2["metadata"][file_id])
+
+        return output_texts
 
 
 def macro_engine2(counter, macros, vars_storage, files_id, texts) -> List[str]:
@@ -509,37 +782,7 @@ def macro_engine2(counter, macros, vars_storage, files_id, texts) -> List[str]:
     look for macro_engine2_single for information about the working of the
     engine
 
+    To process many texts with the same macros, build a MacroEngine once and
+    call its render method.
     """
-
-    output_texts = []
-    # updating data to engine2
-    # copy to avoid the manipulation of original data in macro_engine2
-    vars_storage2 = dict(vars_storage.items())
-    vars_storage2["metadata"]["COUNTER"] = counter
-
-    macros2 = {}
-    for it in macros:
-        output = {}
-        key = it["key"]
-        output["constant"] = it["constant"]
-        output["value"] = it["value"]
-        if "args" in it:
-            output["args"] = it["args"]
-
-        macros2[key] = output
-
-    # calling for each part
-    for file_id, text in zip(files_id, texts):
-        vars_storage2["metadata"]["FILE"] = file_id
-        # cache of the original text un processed
-        if file_id in vars_storage2["metadata"]:
-            vars_storage2["metadata"][f"{file_id}_raw"] = vars_storage2["metadata"][
-                file_id
-            ]
-        # cache of processed text
-        vars_storage2["metadata"][file_id] = macro_engine2_single(
-            macros2, vars_storage2, text
-        )
-        output_texts.append(vars_storage2["metadata"][file_id])
-
-    return output_texts
+    return MacroEngine(macros).render(counter, vars_storage, files_id, texts)
@@ -0,0 +1,168 @@
+"""
+Compact representation of a question of the bank
+"""
+
+from functools import lru_cache
+from pathlib import Path
+from sys import intern
+from typing import Dict, Iterable, Optional, Tuple
+
+from yaml_loader import safe_load, strip_bom
+
+# keys of the question stored as attributes
+METADATA = ("id", "difficulty", "frequency", "scaffold", "autotag", "tags")
+
+# orders of keys already seen (shared by the questions with the same fields)
+ORDERS = {}
+
+
+def intern_tags(tags: Iterable) -> Tuple:
+    """
+    Tags without repetitions, in the order they were added, with the strings
+    interned (each tag is stored once for all the bank)
+    """
+    unique = {}
+    for tag in tags:
+        if isinstance(tag, str):
+            tag = intern(tag)
+        unique[tag] = None
+
+    return tuple(unique)
+
+
+@lru_cache(maxsize=8)
+def read_source(path: str) -> str:
+    """
+    Text of a file of the bank (the last files read are kept), without the
+    byte order mark, as the positions of load_metadata_all
+    """
+    return strip_bom(Path(path).read_text())
+
+
+@lru_cache(maxsize=256)
+def load_fields(source: Tuple[str, int, int]) -> Dict:
+    """
+    Fields of a question from its source: (file, start, end) of its yaml
+    document. The dict is shared, do not modify it.
+    """
+    path, start, end = source
+    return safe_load(read_source(path)[start:end])
+
+
+class Question:
+    """
+    Question of the bank.
+
+    The metadata used to select the questions is kept in slots and the rest of
+    fields of the yaml document (title, texts of each output, ...) in fields.
+    With a source, fields are not kept in memory: they are read again from the
+    file when they are needed (render).
+    It is read and written as the dict of previous versions
+    (question["difficulty"], question["english"], dict(question), ...), so
+    question["tags"] is a new set.
+
+    attributes:
+        id, difficulty, frequency, scaffold, autotag: metadata
+        tags: tuple with the tags (interned), in the order they were added
+        fields: other fields of the question (None if they are in source)
+        order: keys of the question in the original order (shared)
+        source: (file, start, end) of the yaml document or None
+    """
+
+    __slots__ = METADATA + ("fields", "order", "source")
+
+    def __init__(self, data: Dict, source: Optional[Tuple[str, int, int]] = None):
+        self.id = data["id"]
+        self.difficulty = data["difficulty"]
+        self.frequency = data["frequency"]
+        self.scaffold = data["scaffold"]
+        self.autotag = data["autotag"]
+        self.tags = intern_tags(data["tags"])
+        self.source = source
+        self.fields = None
+        if source is None:
+            self.fields = {
+                intern(key): value
+                for key, value in data.items()
+                if key not in METADATA
+            }
+
+        order = tuple(intern(key) for key in data)
+        self.order = ORDERS.setdefault(order, order)
+
+    def __getitem__(self, key):
+        if key == "tags":
+            return set(self.tags)
+        if key in METADATA:
+            return getattr(self, key)
+        if key not in self.order:
+            raise KeyError(key)
+        return self.body()[key]
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            self.order = self.order + (key,)
+
+        if key == "tags":
+            self.tags = intern_tags(value)
+        elif key in METADATA:
+            setattr(self, key, value)
+        else:
+            if self.fields is None:
+                self.fields = {
+                    name: field
+                    for name, field in self.body().items()
+                    if name not in METADATA
+                }
+                self.source = None
+            self.fields[key] = value
+
+    def __contains__(self, key) -> bool:
+        return key in METADATA or key in self.order
+
+    def __iter__(self):
+        return iter(self.order)
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def __repr__(self) -> str:
+        return repr(self.copy())
+
+    def get(self, key, default=None):
+        """
+        Value of key or default if the question doesn't have it
+        """
+        if key in self:
+            return self[key]
+        return default
+
+    def keys(self) -> Tuple:
+        """
+        Keys in the order of the yaml document (new keys at the end)
+        """
+        return self.order
+
+    def body(self) -> Dict:
+        """
+        Fields that are not metadata (read from source if needed)
+        """
+        if self.fields is None:
+            return load_fields(self.source)
+        return self.fields
+
+    def items(self):
+        """
+        Pairs (key, value) in the order of keys
+        """
+        body = self.body()
+        return [
+            (key, self[key] if key in METADATA else body[key])
+            for key in self.order
+        ]
+
+    def copy(self) -> Dict:
+        """
+        dict with all the fields of the question
+        """
+        return dict(self.items())
@@ -1,19 +1,44 @@
 #!/usr/bin/env .venv/bin/python
 
+import logging
+import math
 import time
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Set
 import random
 import re
+import sys
+import tempfile
 from pathlib import Path
-import copy
+import concurrent.futures
+from contextlib import ExitStack
+from itertools import repeat
 
 import typer
 from typing_extensions import Annotated
-import yaml
 
-from macro_engine2 import macro_engine2, load_next_macro
-from tags import look_compatible_questions
+from yaml_loader import safe_load, load_metadata_all, loader_name
+from macro_engine2 import (
+    MacroEngine,
+    MAX_EXPANSIONS,
+    load_next_macro,
+    print_operations,
+)
+from tags import look_compatible_questions, TagIndex
 from counter import Counter
+from bank_cache import BankCache
+from bank_index import (
+    MappedBank,
+    index_filename,
+    load_index,
+    signatures,
+    write_index,
+)
+from sampler import FenwickSampler
+from ledger import Ledger, ledger_filename
+from question import Question, intern_tags, read_source
+from replace_file import replace_file
+
+log = logging.getLogger("rand_exam")
 
 # --------------------------------------------------------------------
 # TODO
@@ -26,25 +51,44 @@ def header(text):
     """
     Create a banner to help to read the logs (open flag)
     """
-    print("")
-    print("-" * 40)
-    print(f"- {text}")
-    print(" ")
+    log.info("\n%s\n- %s\n ", "-" * 40, text)
 
 
-def label(text):
+def label(text, level=logging.DEBUG):
     """
     Create a banner to help to read the logs (closed banner)
     """
-    length = len(text) + 4
-    print("*" * length)
-    print(f"* {text} *")
-    print("*" * length)
+    if log.isEnabledFor(level):
+        length = len(text) + 4
+        log.log(level, "%s\n* %s *\n%s", "*" * length, text, "*" * length)
 
 
 # --------------------------------------------------------------------
 # QUESTIONS
 
+# fields of the questions loaded with the bank (used to select them)
+QUESTION_METADATA = {
+    "ignored",
+    "id",
+    "difficulty",
+    "frequency",
+    "scaffold",
+    "autotag",
+    "tags",
+}
+
+# engines to select questions from a bank (sampler in index file):
+#   legacy: linear passes over the bank (exams of previous versions)
+#   fenwick: FenwickSampler, O(log n) per question
+#   alias: AliasSampler of each part built once, O(1) per question
+SAMPLERS = ["legacy", "fenwick", "alias"]
+
+# engines to look for the exam (search in index file):
+#   random: random attempts, the best one is taken (random_exam)
+#   anneal: simulated annealing from a random attempt (random_exam_anneal)
+#   exact: dynamic programming over the difficulties (random_exam_exact)
+SEARCHES = ["random", "anneal", "exact"]
+
 
 def check_field(field, question) -> Dict:
     """
@@ -66,93 +110,187 @@ def check_compulsory(question, keys):
     """
     for key in keys:
         if key not in question or question[key] is None:
-            print(f' question "{question}" has no key: "{key}"')
+            log.error('question "%s" has no key: "%s"', question, key)
             raise typer.Exit(3)
 
 
 def load_tags(question, filestem):
     """
     Load tags of question and add filestem and all (if it is autotag)
+
+    The tags are returned in the order they were added (see intern_tags)
     """
 
-    tags = set()
+    tags = []
 
     if question["autotag"]:
-        tags.add(filestem)
-        tags.add("all")
+        tags.append(filestem)
+        tags.append("all")
 
     if "tags" in question:
         if isinstance(question["tags"], str):
-            tags.add(question["tags"])
+            tags.append(question["tags"])
         if isinstance(question["tags"], list):
             for tag in question["tags"]:
-                tags.add(tag)
+                tags.append(tag)
 
-    return tags
+    return intern_tags(tags)
 
 
-def inner_load_questions(input_path: Path, accumulated: List) -> List:
-    """Load the questions in a directory or file.
+def load_question_file(input_path: Path) -> List:
+    """Load the questions of a yaml file.
 
-    Returns a List.
-        the values are a list of the questions
+    Returns a List with the questions of the file (ignored ones are skipped).
+
+    Only the metadata is loaded (see QUESTION_METADATA), the rest of fields
+    are read from the file when the question is rendered (Question.source).
+    """
+    file_id = input_path.stem
+    question_id = 0
+    accumulated = []
+    path = str(input_path.resolve())
+    # the spans are positions in the text returned by read_source
+    questions = load_metadata_all(read_source(path), QUESTION_METADATA)
+    for question, span in questions:
+        id = f"{file_id}_{question_id}"
+        question_id+=1
+        # allow to ignore unfinished questions
+        if "ignored" in question:
+            log.debug(" question ignored.")
+            continue
+
+        # Temporal warning of old formats
+        if question.get("difficulty", -1) == 0:
+            raise ValueError(
+                f"""
+ question {question} has difficulty 0. Old format, it has to declare scaffold
+ """
+            )
+
+        # scaffold cases
+        if "scaffold" in question and question["scaffold"] is not False:
+            log.debug("scaffold")
+            question["scaffold"] = True
+            question["difficulty"] = 0
+            question["autotag"] = False
+        else:
+            question["scaffold"] = False
+
+        # default values
+        question["id"] = id
+        question["difficulty"] = question.get("difficulty", 1)
+        question["frequency"] = question.get("frequency", 1)
+        question["autotag"] = question.get("autotag", True)
+
+        # tags archiving
+        question["tags"] = load_tags(question, input_path.stem)
+
+        source = None
+        if span is not None:
+            source = (path, span[0], span[1])
+        accumulated.append(Question(question, source))
+
+    return accumulated
+
+
+def bank_files(input_path: Path, accumulated: List) -> List:
+    """List the yaml files in a directory or file.
+
+    The order is the one of the recursion over glob, so the ids and the
+    selection of questions are the same in every run.
     """
-    print(f"loading {input_path}")
+    log.debug("loading %s", input_path)
     if input_path.is_dir():
-        print("is a dir")
+        log.debug("is a dir")
         for subinput in input_path.glob("*"):
-            accumulated = inner_load_questions(subinput, accumulated)
+            accumulated = bank_files(subinput, accumulated)
     elif input_path.suffix in (".yaml", ".yml"):
-        file_id = input_path.stem
-        question_id=0
-        with input_path.open("r") as fh:
-            questions = yaml.safe_load_all(fh)
-            for question in questions:
-                id = f"{file_id}_{question_id}"
-                question_id+=1
-                # allow to ignore unfinished questions
-                if "ignored" in question:
-                    print(" question ignored.")
-                    continue
-
-                # Temporal warning of old formats
-                if question.get("difficulty", -1) == 0:
-                    raise ValueError(
-                        f"""
- question {question} has difficulty 0. Old format, it has to declare scaffold
- """
-                    )
+        accumulated.append(input_path)
 
-                # scaffold cases
-                if "scaffold" in question and question["scaffold"] is not False:
-                    print("scaffold")
-                    question["scaffold"] = True
-                    question["difficulty"] = 0
-                    question["autotag"] = False
-                else:
-                    question["scaffold"] = False
+    return accumulated
 
-                # default values
-                question["id"] = id
-                question["difficulty"] = question.get("difficulty", 1)
-                question["frequency"] = question.get("frequency", 1)
-                question["autotag"] = question.get("autotag", True)
 
-                # tags archiving
-                question["tags"] = load_tags(question, input_path.stem)
+def inner_load_questions(
+    input_path: Path,
+    accumulated: List,
+    cache: Optional[BankCache] = None,
+    jobs: int = 1,
+) -> List:
+    """Load the questions in a directory or file.
+
+    If cache is given, files not modified since the last run are taken
+    from it instead of parsing them again.
 
-                accumulated.append(question)
+    With jobs > 1 the files to parse are distributed in a pool of processes.
+    The questions are merged in the order of bank_files anyway.
+
+    Returns a List.
+        the values are a list of the questions
+    """
+    files = bank_files(input_path, [])
+
+    loaded = {}
+    if cache:
+        for path in files:
+            questions = cache.get(path)
+            if questions is not None:
+                log.debug(" %s from cache", path)
+                loaded[path] = questions
+
+    pending = [path for path in files if path not in loaded]
+    if jobs > 1 and len(pending) > 1:
+        log.info("parsing %s files with %s jobs", len(pending), jobs)
+        chunksize = max(1, len(pending) // (jobs * 4))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+            parsed = pool.map(load_question_file, pending, chunksize=chunksize)
+            loaded.update(zip(pending, parsed))
+    else:
+        for path in pending:
+            loaded[path] = load_question_file(path)
+
+    if cache:
+        for path in pending:
+            cache.put(path, loaded[path])
+
+    for path in files:
+        accumulated.extend(loaded[path])
 
     return accumulated
 
 
-def load_questions(bank_dir: Path) -> List:
+def load_questions(bank_dir: Path, use_cache: bool = True, jobs: int = 1) -> List:
     """Load questions from a bank_dir.
     wrapper of inner_load_questions.
+
+    With use_cache, an up to date index of the bank (rand-exam.py index) is
+    mapped instead, and the MappedBank is returned as the list of questions.
     """
     header("Loading questions")
-    questions = inner_load_questions(bank_dir, [])
+    start = time.perf_counter()
+    if use_cache:
+        mapped = load_index(bank_dir, bank_files(bank_dir, []))
+        if mapped is not None:
+            assert len(mapped) > 0, "No questions in bank"
+            log.info(
+                "%s questions mapped from %s in %.3f s",
+                len(mapped),
+                mapped.path,
+                time.perf_counter() - start,
+            )
+            return mapped
+
+    cache = BankCache(bank_dir) if use_cache else None
+    questions = inner_load_questions(bank_dir, [], cache, jobs)
     assert len(questions) > 0, "No questions in bank"
+    log.info(
+        "%s questions loaded with %s in %.3f s",
+        len(questions),
+        loader_name(),
+        time.perf_counter() - start,
+    )
+
+    if cache:
+        cache.save()
 
     return questions
 
@@ -169,12 +307,12 @@ def estimated_difficulty_tag(questions) -> float:
     sum_frequency = 0
 
     label("questions")
-    print(questions)
+    log.debug("%s", questions)
 
     for question in questions:
-        print("question", question)
+        log.debug("question %s", question)
         if question["difficulty"] is None or question["frequency"] is None:
-            print(f"question: {question} has no frequency or difficulty")
+            log.warning("question: %s has no frequency or difficulty", question)
             continue
 
         sum_numerator += question["difficulty"] * question["frequency"]
@@ -183,17 +321,25 @@ def estimated_difficulty_tag(questions) -> float:
     return sum_numerator / sum_frequency
 
 
-def random_question(questions, num_questions,used) -> List:
+def random_question(
+    questions, num_questions, used, sampler="legacy", alias=None
+) -> List:
     """
     From list of questions (with correct tags selection) num_questions are selected. (used questions are ignored)
 
     questions: bank of questions. It's a list of questions with correct tags (for certain part).
     num_questions: number of questions to extract
     used: set of used questions along the exam
+    sampler: engine used to select the questions (see SAMPLERS)
+    alias: AliasSampler of questions (required by alias sampler)
     """
 
+    # the alias sampler rejects used questions instead of filtering the bank
+    if sampler == "alias" and len(questions) > num_questions and alias.total > 0:
+        return random_question_alias(questions, num_questions, used, alias)
+
     # filter out "used" questions in "questions"
-    questions = [ it for it in questions if it["id"] not in used]
+    questions = [ it for it in questions if it.id not in used]
 
     # in case available questions are less than num_questions 
     if len(questions) <= num_questions:
@@ -201,11 +347,14 @@ def random_question(questions, num_questions,used) -> List:
 
         for question in questions:
             output.append(question)
-            if not question["scaffold"]:
-                used.add(question["id"])
+            if not question.scaffold:
+                used.add(question.id)
 
         return output,used
 
+    if sampler == "fenwick":
+        return random_question_fenwick(questions, num_questions, used)
+
     return random_question_more(questions, num_questions,used)
 
 
@@ -225,14 +374,65 @@ def random_question_more(questions, num_questions,used) -> List:
         question = random_question_one(questions)
 
         output.append(question)
-        output_used.add(question["id"])
+        output_used.add(question.id)
 
-        questions = [it for it in questions if it["id"] not in output_used]
+        questions = [it for it in questions if it.id not in output_used]
         num_questions-=1
 
     return output,output_used
 
 
+def random_question_fenwick(questions, num_questions, used) -> List:
+    """
+    Same as random_question_more but drawing with a FenwickSampler:
+    O(n + num_questions * log n) instead of O(num_questions * n).
+
+    The random sequence is not the same as random_question_more, so the
+    exams generated with a seed are different.
+    """
+    output = []
+    sampler = FenwickSampler([question.frequency for question in questions])
+
+    for _ in range(num_questions):
+        question = questions[sampler.draw()]
+
+        output.append(question)
+        used.add(question.id)
+
+    return output, used
+
+
+
+def random_question_alias(questions, num_questions, used, alias) -> List:
+    """
+    Same as random_question_more but drawing with the AliasSampler of the
+    bank (O(1) per draw). Used questions are rejected and drawn again.
+
+    If there are too many rejections (few questions available), the rest of
+    questions are selected with the legacy algorithm.
+    """
+    output = []
+    rejections = 0
+    max_rejections = 4 * len(questions) + 16
+
+    while len(output) < num_questions:
+        question = questions[alias.draw()]
+
+        if question.id in used:
+            rejections += 1
+            if rejections > max_rejections:
+                more, used = random_question(
+                    questions, num_questions - len(output), used
+                )
+                output.extend(more)
+                break
+            continue
+
+        output.append(question)
+        used.add(question.id)
+
+    return output, used
+
 
 def random_question_one(questions) -> List:
     """
@@ -243,13 +443,13 @@ def random_question_one(questions) -> List:
 
     accum = 0.0
     for question in questions:
-        accum += question["frequency"]
+        accum += question.frequency
 
     cursor = random.random() * accum
 
     accum = 0.0
     for question in questions:
-        accum += question["frequency"]
+        accum += question.frequency
         if cursor < accum:
             return question
 
@@ -268,7 +468,7 @@ def difficulty_list(questions) -> float:
     difficulty = 0.0
 
     for question in questions:
-        difficulty += question["difficulty"]
+        difficulty += question.difficulty
 
     return difficulty
 
@@ -299,6 +499,50 @@ def default_values(exam):
     if "tolerance" not in exam:
         exam["tolerance"] = 0.5
 
+    if "cache" not in exam:
+        exam["cache"] = True
+
+    if "jobs" not in exam:
+        exam["jobs"] = 1
+
+    if "workers" not in exam:
+        exam["workers"] = 1
+
+    if "render_workers" not in exam:
+        exam["render_workers"] = 1
+
+    if "edition_workers" not in exam:
+        exam["edition_workers"] = 1
+
+    if "exact_max_entries" not in exam:
+        exam["exact_max_entries"] = EXACT_MAX_ENTRIES
+
+    # ledger: None (no ledger) or number of previous editions excluded
+    if "ledger" not in exam:
+        exam["ledger"] = None
+
+    # each question rendered with its own seed (seed + edition, id)
+    if "question_seed" not in exam:
+        exam["question_seed"] = False
+
+    # maximum number of macros expanded in one text
+    if "max_expansions" not in exam:
+        exam["max_expansions"] = MAX_EXPANSIONS
+
+    if "search" not in exam:
+        exam["search"] = "random"
+    if exam["search"] not in SEARCHES:
+        raise ValueError(
+            f"Unknown search <{exam['search']}>. Valid values: {SEARCHES}"
+        )
+
+    if "sampler" not in exam:
+        exam["sampler"] = "legacy"
+    if exam["sampler"] not in SAMPLERS:
+        raise ValueError(
+            f"Unknown sampler <{exam['sampler']}>. Valid values: {SAMPLERS}"
+        )
+
 
 def load_macros(exam):
     """
@@ -309,12 +553,12 @@ def load_macros(exam):
     if "macros" not in exam:
         exam["macros"] = []
     else:
-        label("MACROS")
+        label("MACROS", logging.INFO)
 
         nmacros = []
 
         for key, value in exam["macros"].items():
-            print(key, "->", value)
+            log.info("%s -> %s", key, value)
             _previous, key, args, _post = load_next_macro(key)
             if args:
                 nmacros.append(
@@ -333,7 +577,7 @@ def load_output_files(exam):
     """
 
     if "files" not in exam:
-        print("files field not in exam")
+        log.error("files field not in exam")
         raise ValueError(f"files field not in exam: {exam.keys()}")
 
     # check forbiden names
@@ -351,7 +595,7 @@ def load_output_files(exam):
         file_id = Path(file).stem
 
         if file_id in forbidden_names:
-            print(f"file field <{file}> forbidden")
+            log.error("file field <%s> forbidden", file)
             raise ValueError("field forbidden)")
 
         files_id.append(file_id)
@@ -366,10 +610,11 @@ def load_exam(exam_file: Path) -> Dict:
     header("Loading exam")
 
     with exam_file.open("r") as fh:
-        exam = yaml.safe_load(fh)
+        exam = safe_load(fh)
 
     default_values(exam)
     load_macros(exam)
+    exam["macro_engine"] = MacroEngine(exam["macros"], exam["max_expansions"])
     # load_output_files(exam)
 
     return exam
@@ -396,7 +641,7 @@ def check_exam(exam: Dict, selected_questions: List) -> bool:
     for part, content in zip(exam["parts"], selected_questions):
         tag = part["tag"]
         if not content:
-            print(f" tag <{tag}> doesn't have any question")
+            log.warning(" tag <%s> doesn't have any question", tag)
             return False
 
     return True
@@ -408,7 +653,7 @@ def estimated_difficulty_exam(exam, selected_questions) -> float:
     difficulty = [0.0, 0.0]
 
     label("ede")
-    print(selected_questions)
+    log.debug("%s", selected_questions)
 
     for part, questions in zip(exam["parts"], selected_questions):
         difficulty[0] += estimated_difficulty_tag(questions) * part["num_questions"][0]
@@ -417,40 +662,76 @@ def estimated_difficulty_exam(exam, selected_questions) -> float:
     return difficulty
 
 
+class PartExhausted(Exception):
+    """
+    A part of the exam has fewer questions available than the ones taken in
+    an attempt because the ledger excluded them
+    """
+
+
 def random_exam_item(exam):
     """
     Loop around parts to create a possible exam.
+
+    Raise PartExhausted if the ledger leaves a part without all the questions
+    of the attempt (the attempt would be shorter than the parts ask for).
     """
 
     # extract amount of questions
-    parts = copy.deepcopy(exam["parts"])
+    # the tree is shared by all the attempts, only taken is new
+    parts = exam["parts"]
+    taken = parts.new_taken()
 
     num_of_questions = random.randint(parts.min, parts.max)
-    used_questions = set()
-    parts.update_taken_questions(num_of_questions)
-    print(label("after count finished"))
-    print(parts)
-
-    possible_exam,_ = random_exam_item_recurse(parts,used_questions)
+    used_questions = set(exam["excluded"])
+    parts.update_taken_questions(num_of_questions, taken)
+    label("after count finished")
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("%s", parts.to_str(taken))
+
+    possible_exam, _ = random_exam_item_recurse(
+        parts, used_questions, taken, exam["sampler"], exam["excluded"]
+    )
 
     difficulty = difficulty_list(possible_exam)
 
     return (difficulty, possible_exam)
 
 
-def random_exam_item_recurse(part,used_questions):
+def random_exam_item_recurse(
+    part, used_questions, taken, sampler="legacy", excluded=frozenset()
+):
     """
     runs recursively part to extracts all the questions
+
+    taken: questions taken by each node (see Counter.new_taken)
+    excluded: ids of questions excluded by the ledger
     """
     output = []
     output_used = used_questions 
 
     if part.children:
         for child in part.children:
-            child_possible_exam, output_used = random_exam_item_recurse(child,output_used)
+            child_possible_exam, output_used = random_exam_item_recurse(
+                child, output_used, taken, sampler, excluded
+            )
             output.extend(child_possible_exam)
     else:  # part.bank
-        possible_exam, output_used = random_question(part.bank,part.taken,output_used)
+        possible_exam, output_used = random_question(
+            part.bank, taken[part.node_id], output_used, sampler, part.sampler
+        )
+        # questions used by other parts (overlapping parts) shorten the
+        # attempt as usual, only the ones excluded by the ledger discard it
+        if len(possible_exam) < taken[part.node_id] and excluded:
+            available = sum(
+                1 for question in part.bank if question.id not in excluded
+            )
+            if available < taken[part.node_id] <= len(part.bank):
+                raise PartExhausted(
+                    f"part <{part.lemma}> ran out of questions: "
+                    f"{available} available, {taken[part.node_id]} required "
+                    "(the rest are excluded by the ledger)"
+                )
         output.extend(possible_exam)
 
     return output, output_used
@@ -468,20 +749,36 @@ def random_exam(exam):
     If the requirement are not fullfill, returns a small stats
     about the attemps done.
 
+    With exam["workers"] > 1 the tries are run by random_exam_parallel.
+    With exam["search"] == "anneal" the search is random_exam_anneal.
+    With exam["search"] == "exact" the search is random_exam_exact.
     """
     header(f"Random Exam. Difficulty: {exam['difficulty']}")
 
-    best_difficulty, best_attempt = random_exam_item(exam)
+    if exam["search"] == "anneal":
+        return random_exam_anneal(exam)
 
-    min_difficulty = best_difficulty
-    max_difficulty = best_difficulty
-    exam["tries"] -= 1
+    if exam["search"] == "exact":
+        return random_exam_exact(exam)
 
-    if abs(exam["difficulty"] - best_difficulty) < exam["tolerance"]:
-        return best_attempt
+    if exam["workers"] > 1:
+        return random_exam_parallel(exam)
 
-    for _ in range(exam["tries"]):
-        new_difficulty, new_attempt = random_exam_item(exam)
+    best_difficulty = best_attempt = None
+    min_difficulty = max_difficulty = None
+    exhausted = None
+
+    for _ in range(max(exam["tries"], 1)):
+        try:
+            new_difficulty, new_attempt = random_exam_item(exam)
+        except PartExhausted as exc:
+            # incomplete attempts are not taken into account
+            exhausted = exc
+            continue
+
+        if best_attempt is None:
+            best_difficulty, best_attempt = new_difficulty, new_attempt
+            min_difficulty = max_difficulty = new_difficulty
 
         min_difficulty = (
             new_difficulty if new_difficulty < min_difficulty else min_difficulty
@@ -499,9 +796,556 @@ def random_exam(exam):
         if abs(exam["difficulty"] - best_difficulty) < exam["tolerance"]:
             return best_attempt
 
-    print(
-        f"Exam not found, range measured ({min_difficulty},{max_difficulty}) best_difficulty: {best_difficulty}"
+    if best_attempt is None:
+        log.error("Exam not found, no complete attempt: %s", exhausted)
+        return None
+
+    log.warning(
+        "Exam not found, range measured (%s,%s) best_difficulty: %s",
+        min_difficulty,
+        max_difficulty,
+        best_difficulty,
+    )
+    return None
+
+
+def random_exam_shard(exam, shard, first, last):
+    """
+    Run the tries first..last-1 of random_exam_parallel (in a worker process).
+
+    The random generator is seeded with seed + edition and the shard, so the
+    result doesn't depend on the worker that runs the shard.
+
+    Return (distance, try, difficulty, attempt, min_difficulty, max_difficulty,
+    exhausted) of the best attempt of the shard (the first one in tolerance
+    stops it). Without complete attempts, attempt is None and exhausted is the
+    message of the last PartExhausted.
+    """
+    random.seed(f"{exam['seed'] + exam['edition']}/{shard}")
+
+    best = None
+    exhausted = None
+    for index in range(first, last):
+        try:
+            difficulty, attempt = random_exam_item(exam)
+        except PartExhausted as exc:
+            exhausted = str(exc)
+            continue
+        distance = abs(exam["difficulty"] - difficulty)
+
+        if best is None:
+            min_difficulty = max_difficulty = difficulty
+        min_difficulty = min(min_difficulty, difficulty)
+        max_difficulty = max(max_difficulty, difficulty)
+
+        if best is None or distance < best[0]:
+            best = (distance, index, difficulty, attempt)
+
+        if distance < exam["tolerance"]:
+            break
+
+    if best is None:
+        return (math.inf, last, None, None, None, None, exhausted)
+
+    return best + (min_difficulty, max_difficulty, exhausted)
+
+
+def random_exam_parallel(exam):
+    """
+    Same search as random_exam, but the tries are split in exam["workers"]
+    shards run in a pool of processes.
+
+    The best attempt of all the shards is selected (the nearest to the
+    difficulty and, in case of tie, the lowest try), so the exam is the same
+    whatever the order the shards finish.
+    """
+    workers = exam["workers"]
+    tries = exam["tries"]
+    bounds = [tries * shard // workers for shard in range(workers + 1)]
+    shards = [
+        (shard, bounds[shard], bounds[shard + 1])
+        for shard in range(workers)
+        if bounds[shard] < bounds[shard + 1]
+    ]
+
+    log.info("%s tries in %s shards", tries, len(shards))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(random_exam_shard, exam, shard, first, last)
+            for shard, first, last in shards
+        ]
+        results = [future.result() for future in futures]
+
+    distance, index, difficulty, attempt, _min, _max, _exhausted = min(
+        results, key=lambda result: (result[0], result[1])
+    )
+    if distance < exam["tolerance"]:
+        log.info("exam found in try %s", index)
+        return attempt
+
+    complete = [result for result in results if result[3] is not None]
+    if not complete:
+        exhausted = [result[6] for result in results if result[6]]
+        log.error("Exam not found, no complete attempt: %s", exhausted[-1])
+        return None
+
+    min_difficulty = min(result[4] for result in complete)
+    max_difficulty = max(result[5] for result in complete)
+    log.warning(
+        "Exam not found, range measured (%s,%s) best_difficulty: %s",
+        min_difficulty,
+        max_difficulty,
+        difficulty,
+    )
+    return None
+
+
+def draw_unused(leaf, used, excluded):
+    """
+    Draw a question of the bank of leaf (weighted by frequency) that is not
+    in used or excluded. Return None if none is found after some draws.
+    """
+    for _ in range(16):
+        question = leaf.bank[leaf.sampler.draw()]
+        if question.id not in used and question.id not in excluded:
+            return question
+
+    return None
+
+
+def random_exam_anneal(exam):
+    """
+    Look for an exam with simulated annealing instead of random restarts.
+
+    It starts from a random exam (as random_exam_item) and tries exam["tries"]
+    moves:
+        swap: a question of a part is replaced with another of its bank
+        count: a question is moved between two sibling parts
+        grow/shrink: a question is added to/removed from a part
+    All the moves respect the min and max of the nodes of the tree. The new
+    questions are drawn weighted by frequency (as the samplers).
+
+    A move is accepted if it approaches the difficulty or, with a
+    probability that decreases along the search, if not.
+
+    Stop when the difficulty is in tolerance. Return None if not found.
+    """
+    start = time.perf_counter()
+    parts = exam["parts"]
+    target = exam["difficulty"]
+    parts.build_samplers()
+
+    # initial exam
+    taken = parts.new_taken()
+    parts.update_taken_questions(random.randint(parts.min, parts.max), taken)
+    nodes = parts.nodes()
+    leaves = [node for node in nodes if node.bank and node.sampler.total > 0]
+    selection = {}
+    used = set(exam["excluded"])
+    for node in nodes:
+        if node.bank:
+            selection[node.node_id], used = random_question(
+                node.bank, taken[node.node_id], used, exam["sampler"], node.sampler
+            )
+
+    # path from the root to each leaf (to grow or shrink all the nodes)
+    paths = {parts.node_id: [parts]}
+    for node in nodes:
+        for child in node.children:
+            paths[child.node_id] = paths[node.node_id] + [child]
+    siblings = [
+        [child for child in node.children if child in leaves]
+        for node in nodes
+        if node.children
+    ]
+    siblings = [group for group in siblings if len(group) > 1]
+
+    difficulty = difficulty_list(
+        [question for questions in selection.values() for question in questions]
+    )
+    best_difficulty = difficulty
+    best_selection = {key: list(value) for key, value in selection.items()}
+    temperature = max(
+        (question.difficulty for leaf in leaves for question in leaf.bank),
+        default=1,
+    )
+
+    iterations = 0
+    while (
+        leaves
+        and iterations < exam["tries"]
+        and abs(target - best_difficulty) >= exam["tolerance"]
+    ):
+        iterations += 1
+
+        # proposal: question of source (None: no question removed) replaced
+        # by a new question of destination (None: no question added)
+        move = random.randrange(4)
+        if move == 0:
+            source = destination = random.choice(leaves)
+        elif move == 1 and siblings:
+            group = random.choice(siblings)
+            source = random.choice(group)
+            destination = random.choice(group)
+            if source is destination:
+                continue
+        elif move == 2:
+            source = None
+            destination = random.choice(leaves)
+        else:
+            source = random.choice(leaves)
+            destination = None
+
+        # check min and max of the nodes changed
+        changed = []
+        if source is not destination:
+            if source is not None:
+                changed += [(node, -1) for node in paths[source.node_id]]
+            if destination is not None:
+                changed += [(node, +1) for node in paths[destination.node_id]]
+        if source is not None and destination is not None:
+            # the common ancestors don't change
+            common = {id(node) for node in paths[source.node_id]}
+            common &= {id(node) for node in paths[destination.node_id]}
+            changed = [item for item in changed if id(item[0]) not in common]
+        if any(
+            not node.min <= taken[node.node_id] + step <= node.max
+            for node, step in changed
+        ):
+            continue
+
+        question_out = None
+        if source is not None:
+            if not selection[source.node_id]:
+                continue
+            position = random.randrange(len(selection[source.node_id]))
+            question_out = selection[source.node_id][position]
+
+        question_in = None
+        if destination is not None:
+            question_in = draw_unused(
+                destination,
+                used,
+                {question.id for question in selection[destination.node_id]},
+            )
+            if question_in is None:
+                continue
+
+        new_difficulty = difficulty
+        if question_out is not None:
+            new_difficulty -= question_out.difficulty
+        if question_in is not None:
+            new_difficulty += question_in.difficulty
+
+        delta = abs(target - new_difficulty) - abs(target - difficulty)
+        cooling = temperature * 0.01 ** (iterations / exam["tries"])
+        if delta > 0 and random.random() >= math.exp(-delta / cooling):
+            continue
+
+        # apply the move
+        if question_out is not None:
+            used.discard(question_out.id)
+            selection[source.node_id].pop(position)
+        if question_in is not None:
+            used.add(question_in.id)
+            if source is destination:
+                selection[destination.node_id].insert(position, question_in)
+            else:
+                selection[destination.node_id].append(question_in)
+        for node, step in changed:
+            taken[node.node_id] += step
+        difficulty = new_difficulty
+
+        if abs(target - difficulty) < abs(target - best_difficulty):
+            best_difficulty = difficulty
+            best_selection = {key: list(value) for key, value in selection.items()}
+
+    log.info(
+        "anneal: %s iterations in %.3f s, best_difficulty: %s",
+        iterations,
+        time.perf_counter() - start,
+        best_difficulty,
+    )
+    if abs(target - best_difficulty) >= exam["tolerance"]:
+        log.warning("Exam not found, best_difficulty: %s", best_difficulty)
+        return None
+
+    output = []
+    for node in nodes:
+        if node.bank:
+            output.extend(best_selection[node.node_id])
+
+    return output
+
+
+def weighted_choice(options: Dict):
+    """
+    Random key of options (key -> weight), weighted by its value
+    """
+    cursor = random.random() * sum(options.values())
+
+    accum = 0.0
+    for key, weight in options.items():
+        accum += weight
+        if cursor < accum:
+            return key
+
+    return key
+
+
+# entries (count, difficulty) of the tables of the exact search kept in
+# memory at the same time (about 100 bytes each)
+EXACT_MAX_ENTRIES = 2_000_000
+
+
+def normalized(table: Dict) -> Dict:
+    """
+    table with the weights divided by the biggest one. Only the relative
+    weights inside a table are used, so they don't overflow with big banks.
+    """
+    top = max(table.values(), default=0.0)
+    if top <= 0:
+        return table
+
+    return {key: weight / top for key, weight in table.items()}
+
+
+def exact_step(table: Dict, question, low: int, high: int) -> Dict:
+    """
+    Distribution of the questions from question to the end, given the one
+    (table) of the questions after question. Only the counts in low..high are
+    kept (the rest can't complete a selection of the part).
+    """
+    difficulty = question.difficulty
+    if difficulty != int(difficulty):
+        raise ValueError(f"exact search requires integer difficulties: {question.id}")
+
+    current = {key: weight for key, weight in table.items() if key[0] >= low}
+    if question.frequency > 0:
+        for (count, total), weight in table.items():
+            if low <= count + 1 <= high:
+                key = (count + 1, total + int(difficulty))
+                weight *= question.frequency
+                current[key] = current.get(key, 0.0) + weight
+
+    return normalized(current)
+
+
+def exact_leaf_tables(node, bank: List, table: Dict, start: int, stop: int) -> List:
+    """
+    Suffix tables of bank from position start to stop, given table (the
+    one of position stop). The table of position pos (questions pos..end)
+    only keeps the counts that can reach node.min with the questions before.
+    """
+    tables = [table]
+    for pos in range(stop - 1, start - 1, -1):
+        low = max(0, node.min - pos)
+        tables.append(exact_step(tables[-1], bank[pos], low, node.max))
+    tables.reverse()
+    return tables
+
+
+def exact_leaf_size(node, bank: List, step: int) -> int:
+    """
+    Upper bound of the entries of the tables of a bank kept in memory at the
+    same time (checkpoints and the block of exact_sample), to fail before
+    calculating them
+    """
+    difficulties = [int(question.difficulty) for question in bank]
+    spread = max(difficulties, default=0) - min(difficulties, default=0)
+    checkpoints = 0
+    biggest = 1
+    for pos in range(0, len(bank) + 1, step):
+        # c of the remaining questions have at most min(c, remaining - c) *
+        # spread + 1 totals (taking c is leaving remaining - c)
+        remaining = len(bank) - pos
+        size = sum(
+            min(count, remaining - count) * spread + 1
+            for count in range(max(0, node.min - pos), min(node.max, remaining) + 1)
+        )
+        biggest = max(biggest, size)
+        checkpoints += size
+
+    return checkpoints + step * biggest
+
+
+def exact_tables(node, tables: Dict, excluded=frozenset(), budget=None) -> Dict:
+    """
+    Calculate the distribution of node: (taken, difficulty) -> weight, where
+    weight is proportional to the sum of the products of the frequencies of
+    all the possible selections with that number of questions and difficulty
+    (normalized, see normalized).
+
+    The intermediate tables and the distribution of every node are stored
+    in tables (by node_id) to be used by exact_sample. For a bank, only one
+    of every step suffix tables is stored (checkpoints), the rest are
+    calculated again by exact_sample.
+
+    The questions in excluded are not taken into account.
+
+    budget: [entries] that can still be kept in memory (EXACT_MAX_ENTRIES by
+    default). Raise ValueError if the tables need more.
+    """
+    if budget is None:
+        budget = [EXACT_MAX_ENTRIES]
+
+    if node.bank:
+        bank = [question for question in node.bank if question.id not in excluded]
+        step = max(1, math.isqrt(len(bank)))
+        if exact_leaf_size(node, bank, step) > budget[0]:
+            raise ValueError(
+                f"exact search: the tables of part <{node.lemma}> need more "
+                "than exact_max_entries entries. Use search: anneal or random"
+            )
+        # checkpoints[pos]: distribution of the questions from pos to the end
+        checkpoints = {len(bank): {(0, 0): 1.0}}
+        table = checkpoints[len(bank)]
+        biggest = 1
+        for pos in range(len(bank) - 1, -1, -1):
+            low = max(0, node.min - pos)
+            table = exact_step(table, bank[pos], low, node.max)
+            biggest = max(biggest, len(table))
+            if pos % step == 0:
+                checkpoints[pos] = table
+                budget[0] -= len(table)
+            # the block recalculated by exact_sample is in memory too
+            if budget[0] - step * biggest < 0:
+                raise ValueError(
+                    f"exact search: the tables of part <{node.lemma}> need more "
+                    "than exact_max_entries entries. Use search: anneal or random"
+                )
+        intermediate = (bank, step, checkpoints)
+        distribution = table
+    else:
+        # prefix[j]: distribution of the children before j (only the counts
+        # that can reach node.min with the children after them)
+        pending_max = sum(child.max for child in node.children)
+        prefix = [{(0, 0): 1.0}]
+        for child in node.children:
+            child_distribution = exact_tables(child, tables, excluded, budget)
+            pending_max -= child.max
+            current = {}
+            for (count1, total1), weight1 in prefix[-1].items():
+                for (count2, total2), weight2 in child_distribution.items():
+                    count = count1 + count2
+                    if node.min - pending_max <= count <= node.max:
+                        key = (count, total1 + total2)
+                        current[key] = current.get(key, 0.0) + weight1 * weight2
+            prefix.append(normalized(current))
+            budget[0] -= len(current)
+            if budget[0] < 0:
+                raise ValueError(
+                    f"exact search: the tables of part <{node.lemma}> need more "
+                    "than exact_max_entries entries. Use search: anneal or random"
+                )
+        intermediate = prefix
+        distribution = prefix[-1]
+
+    distribution = {
+        key: weight
+        for key, weight in distribution.items()
+        if node.min <= key[0] <= node.max and weight > 0
+    }
+    tables[node.node_id] = (intermediate, distribution)
+    return distribution
+
+
+def exact_sample(node, count, total, tables: Dict) -> List:
+    """
+    Random selection of count questions with difficulty total from node
+    (weighted by frequency), using the tables of exact_tables.
+    """
+    if node.bank:
+        (bank, step, checkpoints), _distribution = tables[node.node_id]
+        output = []
+        block = []
+        for pos, question in enumerate(bank):
+            if count == 0:
+                break
+            if pos % step == 0:
+                # suffix tables of pos..pos+step from the next checkpoint
+                stop = min(pos + step, len(bank))
+                block = exact_leaf_tables(node, bank, checkpoints[stop], pos, stop)
+            following = block[pos % step + 1]
+            remaining = (count - 1, total - int(question.difficulty))
+            taking = question.frequency * following.get(remaining, 0.0)
+            weight = following.get((count, total), 0.0) + taking
+            if random.random() * weight < taking:
+                output.append(question)
+                count, total = remaining
+
+        return output
+
+    prefix, _distribution = tables[node.node_id]
+    selected = []
+    for pos in range(len(node.children) - 1, -1, -1):
+        child = node.children[pos]
+        _intermediate, child_distribution = tables[child.node_id]
+        options = {}
+        for (count2, total2), weight2 in child_distribution.items():
+            weight1 = prefix[pos].get((count - count2, total - total2), 0.0)
+            if weight1 > 0:
+                options[(count2, total2)] = weight1 * weight2
+        count2, total2 = weighted_choice(options)
+        selected.append(exact_sample(child, count2, total2, tables))
+        count, total = count - count2, total - total2
+
+    output = []
+    for questions in reversed(selected):
+        output.extend(questions)
+    return output
+
+
+def random_exam_exact(exam):
+    """
+    Look for an exam solving the selection as a bounded subset sum with
+    dynamic programming over the tree of parts (integer difficulties only).
+
+    The distribution (taken, difficulty) -> weight of every node is
+    calculated once, so an exam in tolerance is found if it exists, and it
+    is selected weighted by the frequencies among all of them. If there is
+    no solution, it is reported without trying.
+
+    The parts are solved independently: if a question is selected twice
+    (banks with common questions) the exam is drawn again (up to tries).
+    """
+    start = time.perf_counter()
+    parts = exam["parts"]
+    parts.number_nodes()
+
+    tables = {}
+    try:
+        distribution = exact_tables(
+            parts, tables, exam["excluded"], [exam["exact_max_entries"]]
+        )
+    except ValueError as exc:
+        log.error("%s", exc)
+        return None
+    valid = {
+        key: weight
+        for key, weight in distribution.items()
+        if abs(exam["difficulty"] - key[1]) < exam["tolerance"]
+    }
+    log.info(
+        "exact: %s (taken, difficulty) pairs in %.3f s",
+        len(distribution),
+        time.perf_counter() - start,
     )
+
+    if not valid:
+        difficulties = sorted({key[1] for key in distribution})
+        log.warning("Exam not found, no exam in tolerance. Possible: %s", difficulties)
+        return None
+
+    for _ in range(exam["tries"]):
+        count, total = weighted_choice(valid)
+        output = exact_sample(parts, count, total, tables)
+
+        ids = [question["id"] for question in output if not question["scaffold"]]
+        if len(ids) == len(set(ids)):
+            return output
+
+    log.warning("Exam not found, all the exams drawn repeat questions")
     return None
 
 
@@ -557,7 +1401,7 @@ def locate_empty_filename(index_file, exam):
         searching = False
 
         files = gen_filenames(index_file, exam, counter)
-        print("Testing existence of:", files)
+        log.info("Testing existence of: %s", files)
 
         for file in files:
             if file.exists():
@@ -576,71 +1420,221 @@ def locate_empty_filename(index_file, exam):
 # Render
 
 
+def render_question(engine, files_id, question, counter, seed=None) -> List[str]:
+    """
+    Render the fields of a question (one for each file id) with the macro
+    engine.
+
+    With seed (question_seed), the random generator is seeded with the seed
+    and the id of the question, so its random values don't depend on the
+    other questions and questions can be rendered in any order.
+    """
+    # the macro engine saves data in question: a copy keeps the bank
+    # ready for the next editions
+    question = dict(question)
+    label("question")
+    log.debug("%s", question)
+    inputs = []
+    for fid in files_id:
+        question = check_field(fid, question)
+        inputs.append(question[fid])
+
+    if seed is not None:
+        random.seed(f"{seed}/{question['id']}")
+
+    return engine.render(counter, {"metadata": question}, files_id, inputs)
+
+
 def render_exam(exam, exam_instance):
     """
     Create the output filename of description and notes.
 
     Apply macro engine to substitute macros and update question counter
-    """
-    header("Rendering")
 
-    counter = 1
-    print(exam.keys())
-    print(exam["files_id"])
-    print(exam["filenames"])
+    With question_seed and render_workers > 1, the questions are rendered in a
+    process pool (in order, with the counters assigned before).
 
-    output_texts = {it: "" for it in exam["files_id"]}
+    The header, each question and the footer are written as soon as they are
+    rendered to a temporary file next to each output file. The temporary files
+    are renamed when everything was rendered, so a failed render doesn't leave
+    partial files (the temporary files are removed).
+    """
+    header("Rendering")
 
-    # headers
-    inputs = []
-    for fid in exam["files_id"]:
-        if f"begin_{fid}" in exam:
-            inputs.append(exam[f"begin_{fid}"])
-        else:
-            inputs.append("")
-    outputs = macro_engine2(
-        0, exam["macros"], {"metadata": {}}, exam["files_id"], inputs
-    )
-    for index, content in zip(exam["files_id"], outputs):
-        output_texts[index] += content
+    engine = exam["macro_engine"]
+    log.debug("%s", exam.keys())
+    log.info("%s", exam["files_id"])
+    log.info("%s", exam["filenames"])
 
-    # questions
+    # counter of each question (scaffolds don't increment it)
+    counters = []
+    counter = 1
     for question in exam_instance:
-        label("question")
-        print(question)
-        inputs = []
-        for fid in exam["files_id"]:
-            question = check_field(fid, question)
-            inputs.append(question[fid])
-
-        outputs = macro_engine2(
-            counter, exam["macros"], {"metadata": question}, exam["files_id"], inputs
-        )
-        for index, content in zip(exam["files_id"], outputs):
-            output_texts[index] += content
-
+        counters.append(counter)
         if not question["scaffold"]:
             counter += 1
 
-    # footer
-    inputs = []
-    for fid in exam["files_id"]:
-        if f"end_{fid}" in exam:
-            inputs.append(exam[f"end_{fid}"])
-        else:
-            inputs.append("")
-    outputs = macro_engine2(
-        0, exam["macros"], {"metadata": {}}, exam["files_id"], inputs
-    )
-    for index, content in zip(exam["files_id"], outputs):
-        output_texts[index] += content
+    seed = None
+    if exam["question_seed"]:
+        seed = exam["seed"] + exam["edition"]
+
+    # a temporary file for each writer, so parallel runs (make -j) don't
+    # write over each other, as BankCache.save
+    tmp_filenames = []
+
+    try:
+        with ExitStack() as stack:
+            handles = []
+            for filename in exam["filenames"]:
+                fh = stack.enter_context(
+                    tempfile.NamedTemporaryFile(
+                        "w",
+                        dir=filename.parent,
+                        prefix=f".{filename.name}.",
+                        suffix=".tmp",
+                        delete=False,
+                    )
+                )
+                tmp_filenames.append(Path(fh.name))
+                handles.append(fh)
+
+            arguments = (
+                repeat(engine),
+                repeat(exam["files_id"]),
+                exam_instance,
+                counters,
+                repeat(seed),
+            )
+            workers = exam["render_workers"]
+            if seed is not None and workers > 1:
+                pool = stack.enter_context(
+                    concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+                )
+                chunksize = max(1, len(exam_instance) // (workers * 4))
+                rendered = pool.map(render_question, *arguments, chunksize=chunksize)
+            else:
+                rendered = map(render_question, *arguments)
+
+            # headers
+            if seed is not None:
+                random.seed(f"{seed}/begin")
+            inputs = []
+            for fid in exam["files_id"]:
+                if f"begin_{fid}" in exam:
+                    inputs.append(exam[f"begin_{fid}"])
+                else:
+                    inputs.append("")
+            outputs = engine.render(0, {"metadata": {}}, exam["files_id"], inputs)
+            for fh, content in zip(handles, outputs):
+                fh.write(content)
+
+            # questions
+            for outputs in rendered:
+                for fh, content in zip(handles, outputs):
+                    fh.write(content)
+
+            # footer
+            if seed is not None:
+                random.seed(f"{seed}/end")
+            inputs = []
+            for fid in exam["files_id"]:
+                if f"end_{fid}" in exam:
+                    inputs.append(exam[f"end_{fid}"])
+                else:
+                    inputs.append("")
+            outputs = engine.render(0, {"metadata": {}}, exam["files_id"], inputs)
+            for fh, content in zip(handles, outputs):
+                fh.write(content + "\n")
+    except BaseException:
+        for tmp_filename in tmp_filenames:
+            tmp_filename.unlink(missing_ok=True)
+        raise
 
     # writing to the files
     header("Writing the files")
-    for file_id, filename in zip(exam["files_id"], exam["filenames"]):
-        print("Save of", filename)
-        with filename.open("w") as fh:
-            fh.write(output_texts[file_id] + "\n")
+    for tmp_filename, filename in zip(tmp_filenames, exam["filenames"]):
+        log.info("Save of %s", filename)
+        replace_file(tmp_filename, filename)
+
+
+# --------------------------------------------------------------------
+# Editions
+
+
+def parse_editions(editions: str) -> List[int]:
+    """
+    Parse the editions option: "START..END" (both included)
+    """
+    match = re.fullmatch(r"(\d+)\.\.(\d+)", editions.strip())
+    if not match or int(match[2]) < int(match[1]):
+        raise typer.BadParameter(f"editions <{editions}> is not START..END")
+
+    return list(range(int(match[1]), int(match[2]) + 1))
+
+
+def relax_excluded(parts, excluded: Set[str], ledger: Ledger) -> Set[str]:
+    """
+    Questions excluded by the ledger, leaving enough questions for the
+    minimum of every part. When a part would run out, its excluded questions
+    are allowed again, the least recently used first (see Ledger.least_recent).
+    """
+    excluded = set(excluded)
+    for node in parts.nodes():
+        if not node.bank:
+            continue
+
+        missing = node.min - sum(
+            1 for question in node.bank if question.id not in excluded
+        )
+        if missing <= 0:
+            continue
+
+        allowed = ledger.least_recent(
+            {question.id for question in node.bank if question.id in excluded}
+        )[:missing]
+        excluded.difference_update(allowed)
+        log.warning(
+            "part <%s> has not enough questions out of the ledger, "
+            "used again (least recently used): %s",
+            node.lemma,
+            allowed,
+        )
+
+    return excluded
+
+
+def generate_edition(
+    index_file: Path, exam: Dict, edition: int, excluded=frozenset()
+) -> Optional[List]:
+    """
+    Select and render one edition of the exam. exam (with parts and
+    files_id) is not modified, so it is reused by all the editions.
+
+    The random generator is seeded with seed + edition, so the output is the
+    same as a run with --edition.
+
+    excluded: ids of questions that can't be selected (see Ledger)
+
+    Return the ids of the questions selected (scaffolds apart) or None if
+    the exam isn't found.
+    """
+    exam = dict(exam)
+    exam["edition"] = edition
+    exam["excluded"] = excluded
+    exam["filenames"] = gen_filenames(index_file, exam, edition)
+    log.info("  filenames %s", exam["filenames"])
+
+    random.seed(exam["seed"] + exam["edition"])
+
+    exam_instance = random_exam(exam)
+    if not exam_instance:
+        return None
+
+    log.info("exam wished difficulty %s", exam["difficulty"])
+    log.info("real difficulty %s", difficulty_list(exam_instance))
+
+    render_exam(exam, exam_instance)
+    return [question["id"] for question in exam_instance if not question["scaffold"]]
 
 
 # --------------------------------------------------------------------
@@ -684,6 +1678,28 @@ parts:
 # --------------------------------------------------------------------
 
 
+def list_operations(value: bool):
+    """
+    Callback of --list-ops: print the internal operations and exit
+    """
+    if value:
+        print_operations()
+        raise typer.Exit()
+
+
+def setup_logging(verbose: bool, quiet: bool):
+    """
+    Configure the log of the run (--verbose, --quiet)
+    """
+    level = logging.INFO
+    if verbose:
+        level = logging.DEBUG
+    elif quiet:
+        level = logging.WARNING
+    # the log goes to stdout, as the output of previous versions
+    logging.basicConfig(level=level, format="%(message)s", stream=sys.stdout)
+
+
 def main(
     index_file: Annotated[
         Path,
@@ -710,11 +1726,66 @@ def main(
     tolerance: Annotated[
         float, typer.Option("--tolerance", "-t", help="Tolerance to select exam")
     ] = None,
+    jobs: Annotated[
+        int,
+        typer.Option("--jobs", "-j", help="Processes used to parse the bank"),
+    ] = None,
+    workers: Annotated[
+        int,
+        typer.Option("--workers", "-w", help="Processes used to search the exam"),
+    ] = None,
+    render_workers: Annotated[
+        int,
+        typer.Option(
+            "--render-workers",
+            "-r",
+            help="Processes used to render the questions (with question_seed)",
+        ),
+    ] = None,
+    edition_workers: Annotated[
+        int,
+        typer.Option(
+            "--edition-workers",
+            help="Processes used to generate the editions of --editions",
+        ),
+    ] = None,
+    editions: Annotated[
+        Optional[str],
+        typer.Option(
+            "--editions",
+            help="Generate the editions START..END (both included) in one run",
+        ),
+    ] = None,
+    no_cache: Annotated[
+        bool,
+        typer.Option("--no-cache", help="Parse every file of the bank (ignore cache)"),
+    ] = False,
+    verbose: Annotated[
+        bool,
+        typer.Option(
+            "--verbose", "-v", help="Log every question and macro (debug)"
+        ),
+    ] = False,
+    quiet: Annotated[
+        bool,
+        typer.Option("--quiet", "-q", help="Log only warnings and errors"),
+    ] = False,
+    _list_ops: Annotated[
+        bool,
+        typer.Option(
+            "--list-ops",
+            help="Show the internal operations of the macro engine and exit",
+            callback=list_operations,
+            is_eager=True,
+        ),
+    ] = False,
 ):
-    print("index_file", index_file)
+    setup_logging(verbose, quiet)
+
+    log.info("index_file %s", index_file)
     if not index_file.exists():
         create_index_file(index_file)
-        print("index file created: but it is obsolete. You have to retouch")
+        log.warning("index file created: but it is obsolete. You have to retouch")
         return
 
     exam = load_exam(index_file)
@@ -725,51 +1796,153 @@ def main(
         ("seed", seed),
         ("tries", tries),
         ("tolerance", tolerance),
+        ("jobs", jobs),
+        ("workers", workers),
+        ("render_workers", render_workers),
+        ("edition_workers", edition_workers),
     ]:
         if cli_parameter:
             exam[parameter] = cli_parameter
 
+    if no_cache:
+        exam["cache"] = False
+
     # Especific options configuration
     if exam["bank"] is None:
         raise ValueError("No bank dir in index_file or CLI options")
 
     # Filenames + Edition
-    header("Output filenames")
-    if edition is None:
-        filenames, edition = locate_empty_filename(index_file, exam)
+    if editions is None:
+        if edition is None:
+            header("Output filenames")
+            _filenames, edition = locate_empty_filename(index_file, exam)
+        editions_list = [edition]
     else:
-        filenames = gen_filenames(index_file, exam, edition)
-    print("  filenames", filenames)
-    exam["filenames"] = filenames
+        editions_list = parse_editions(editions)
     exam["files_id"] = gen_fileid(exam)
 
-    exam["edition"] = edition
-
-    random.seed(exam["seed"] + exam["edition"])
-
     # reading questions
-    questions = load_questions(exam["bank"])
+    questions = load_questions(exam["bank"], exam["cache"], exam["jobs"])
 
     # count bank of questions
     header("Counting questions")
-    exam["parts"] = Counter(exam["parts"], questions)
-    print(exam["parts"])
+    if isinstance(questions, MappedBank):
+        tag_index = TagIndex(questions, questions.bitsets())
+    else:
+        tag_index = TagIndex(questions)
+    exam["parts"] = Counter(exam["parts"], tag_index)
+    log.info("%s", exam["parts"])
     if not exam["parts"].is_correct():
-        print("Dying, parts description is not correct")
+        log.error("Dying, parts description is not correct")
         raise typer.Exit(1)
-    print(exam["parts"])
+    if exam["sampler"] == "alias":
+        exam["parts"].build_samplers()
+    log.debug("%s", exam["parts"])
 
     # selected_questions = extract_possibly_questions(exam, questions)
 
-    exam_instance = random_exam(exam)
-    if not exam_instance:
+    ledger = None
+    if exam["ledger"] is not None:
+        ledger = Ledger(ledger_filename(index_file))
+
+    # editions in parallel: each edition is searched as in a run with
+    # --edition (same workers), so the exams don't depend on edition_workers
+    parallel = len(editions_list) > 1 and exam["edition_workers"] > 1
+    if parallel and exam["ledger"]:
+        log.info("ledger excludes questions of previous editions: not in parallel")
+        parallel = False
+
+    if parallel:
+        header(f"Generating {len(editions_list)} editions in parallel")
+        chunksize = -(-len(editions_list) // exam["edition_workers"])
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=exam["edition_workers"]
+        ) as pool:
+            generated = list(
+                pool.map(
+                    generate_edition,
+                    repeat(index_file),
+                    repeat(dict(exam, render_workers=1)),
+                    editions_list,
+                    chunksize=chunksize,
+                )
+            )
+        if ledger:
+            for edition, selected in zip(editions_list, generated):
+                if selected is not None:
+                    ledger.record(selected, edition)
+    else:
+        generated = []
+        for edition in editions_list:
+            excluded = set()
+            if ledger:
+                excluded = ledger.excluded(edition, exam["ledger"])
+                excluded = relax_excluded(exam["parts"], excluded, ledger)
+            selected = generate_edition(index_file, exam, edition, excluded)
+            if ledger and selected is not None:
+                ledger.record(selected, edition)
+            generated.append(selected)
+
+    if ledger:
+        ledger.save()
+
+    failed = [
+        edition
+        for edition, selected in zip(editions_list, generated)
+        if selected is None
+    ]
+    if failed:
+        log.error("editions not generated: %s", failed)
         raise typer.Exit(2)
 
-    print("exam wished difficulty", exam["difficulty"])
-    print("real difficulty", difficulty_list(exam_instance))
 
-    render_exam(exam, exam_instance)
+def index_bank(
+    bank: Annotated[
+        Path,
+        typer.Argument(help="Bank of questions to index (directory or yaml file)"),
+    ],
+    jobs: Annotated[
+        int,
+        typer.Option("--jobs", "-j", help="Processes used to parse the bank"),
+    ] = 1,
+    verbose: Annotated[
+        bool,
+        typer.Option("--verbose", "-v", help="Log every file and question (debug)"),
+    ] = False,
+    quiet: Annotated[
+        bool,
+        typer.Option("--quiet", "-q", help="Log only warnings and errors"),
+    ] = False,
+):
+    """
+    Compile the bank into a binary index, mapped by the next runs while the
+    files of the bank don't change.
+    """
+    setup_logging(verbose, quiet)
+
+    header("Indexing questions")
+    start = time.perf_counter()
+    path = index_filename(bank)
+    files_signature = signatures(bank_files(bank, []))
+    questions = inner_load_questions(bank, [], None, jobs)
+    try:
+        write_index(path, files_signature, questions)
+    except (ValueError, OSError) as exc:
+        log.error("index %s not written: %s", path, exc)
+        raise typer.Exit(1)
+
+    log.info(
+        "%s questions indexed in %s in %.3f s",
+        len(questions),
+        path,
+        time.perf_counter() - start,
+    )
 
 
 if __name__ == "__main__":
-    typer.run(main)
+    # rand-exam.py index BANK: build the index of a bank
+    if sys.argv[1:2] == ["index"]:
+        sys.argv[0:2] = [f"{sys.argv[0]} index"]
+        typer.run(index_bank)
+    else:
+        typer.run(main)
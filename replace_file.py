@@ -0,0 +1,28 @@
+"""
+Replace a file with a temporary file written next to it
+"""
+
+import os
+from pathlib import Path
+
+
+def default_mode() -> int:
+    """
+    Mode of a new file (0o666 without the bits of the umask)
+    """
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def replace_file(tmp_name, path: Path):
+    """
+    Move tmp_name to path. The file keeps the mode of the previous one (or
+    the mode of a new file), not the 0600 of tempfile.NamedTemporaryFile.
+    """
+    try:
+        mode = os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        mode = default_mode()
+    os.chmod(tmp_name, mode)
+    os.replace(tmp_name, path)
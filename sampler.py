@@ -0,0 +1,142 @@
+"""
+Weighted samplers used to select questions from a bank
+"""
+
+import random
+from typing import List
+
+
+class FenwickSampler:
+    """
+    Weighted sampling without replacement with a Fenwick (binary indexed) tree.
+
+    Drawing and removing an element is O(log n) instead of the O(n) passes of
+    random_question_one.
+
+    attributes:
+        weights: current weight of each element (None when removed)
+        tree: Fenwick tree of weights (1-based)
+        total: sum of the current weights
+        remaining: number of elements not drawn yet
+    """
+
+    def __init__(self, weights: List[float]):
+        self.weights = list(weights)
+        self.size = len(self.weights)
+        self.tree = [0.0] + self.weights
+        self.total = 0.0
+        self.remaining = self.size
+
+        # O(n) construction of the tree
+        for pos in range(1, self.size + 1):
+            parent = pos + (pos & -pos)
+            if parent <= self.size:
+                self.tree[parent] += self.tree[pos]
+            self.total += self.weights[pos - 1]
+
+        self.top = 1
+        while self.top * 2 <= self.size:
+            self.top *= 2
+
+    def find(self, cursor: float) -> int:
+        """
+        Index of the element where the cumulative weight passes cursor
+        """
+        pos = 0
+        step = self.top
+        while step:
+            following = pos + step
+            if following <= self.size and self.tree[following] <= cursor:
+                pos = following
+                cursor -= self.tree[following]
+            step //= 2
+
+        if pos < self.size and self.weights[pos] is not None:
+            return pos
+
+        # cursor out of range (rounding or no weight left): as in
+        # random_question_one, the last element available is taken
+        pos = self.size - 1
+        while self.weights[pos] is None:
+            pos -= 1
+        return pos
+
+    def remove(self, index: int):
+        """
+        Remove element index from the sampler
+        """
+        weight = self.weights[index]
+        self.weights[index] = None
+        self.remaining -= 1
+        self.total -= weight
+
+        pos = index + 1
+        while pos <= self.size:
+            self.tree[pos] -= weight
+            pos += pos & -pos
+
+    def draw(self) -> int:
+        """
+        Extract one random element (weighted) and remove it
+        """
+        assert self.remaining > 0, "In FenwickSampler.draw with no elements"
+
+        index = self.find(random.random() * self.total)
+        self.remove(index)
+        return index
+
+
+class AliasSampler:
+    """
+    Weighted sampling with replacement with the alias method (Vose).
+
+    The tables are built once in O(n) and each draw is O(1). The sampler is
+    not modified by draw, so it can be shared by all the attempts of an exam
+    (questions already used are rejected by the caller).
+
+    attributes:
+        size: number of elements
+        total: sum of the weights
+        probability: probability to keep the column drawn
+        alias: element taken when the column is not kept
+    """
+
+    def __init__(self, weights: List[float]):
+        self.size = len(weights)
+        self.total = float(sum(weights))
+        self.probability = [1.0] * self.size
+        self.alias = list(range(self.size))
+
+        if self.total <= 0:
+            return
+
+        scaled = [weight * self.size / self.total for weight in weights]
+        small = [pos for pos, value in enumerate(scaled) if value < 1.0]
+        large = [pos for pos, value in enumerate(scaled) if value >= 1.0]
+
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+
+            self.probability[less] = scaled[less]
+            self.alias[less] = more
+
+            scaled[more] = scaled[more] + scaled[less] - 1.0
+            if scaled[more] < 1.0:
+                small.append(more)
+            else:
+                large.append(more)
+
+        # remaining columns (rounding errors) are kept always
+        for pos in small + large:
+            self.probability[pos] = 1.0
+
+    def draw(self) -> int:
+        """
+        Index of a random element (weighted). The element is not removed.
+        """
+        column = int(random.random() * self.size)
+        if random.random() < self.probability[column]:
+            return column
+
+        return self.alias[column]
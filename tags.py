@@ -2,7 +2,7 @@
 Tags processing and search for questions in tags
 """
 
-from typing import List
+from typing import Dict, List, Optional, Sequence, Tuple
 
 
 def tag_query(tag_str: str) -> List:
@@ -52,3 +52,96 @@ def look_compatible_questions(tag_description: List, questions: List) -> List:
             compatible_subset.append(question)
 
     return compatible_subset
+
+
+def bit_positions(bits: int) -> List[int]:
+    """
+    Positions of the bits set in bits (ascending order)
+    """
+    # binary representation reversed: char i is bit i
+    binary = bin(bits)[:1:-1]
+    return [pos for pos, char in enumerate(binary) if char == "1"]
+
+
+def compile_query(tag_description: List):
+    """
+    Convert a query (output of tag_query) into a function.
+
+    The function receives a TagIndex and returns the bitset of the compatible
+    questions. The words are operated as bitsets:
+        !: NOT, &: AND, |: OR, any other word: questions with that tag
+    """
+    status = []
+    for word in tag_description:
+        if word == "!":
+            a = status.pop()
+            status.append(lambda index, a=a: index.all & ~a(index))
+        elif word == "&":
+            a = status.pop()
+            b = status.pop()
+            status.append(lambda index, a=a, b=b: a(index) & b(index))
+        elif word == "|":
+            a = status.pop()
+            b = status.pop()
+            status.append(lambda index, a=a, b=b: a(index) | b(index))
+        else:
+            status.append(lambda index, word=word: index.bitsets.get(word, 0))
+
+    assert len(status) == 1
+    return status.pop()
+
+
+class TagIndex:
+    """
+    Inverted index of the tags of a bank of questions.
+
+    attributes:
+        questions: questions indexed (the position is the bit of the question)
+        bitsets: tag -> int with the bits of the questions with the tag
+        all: int with the bits of all the questions
+        results: query (tuple) -> compatible questions, shared between
+                 the callers with the same query (do not modify them)
+    """
+
+    def __init__(self, questions: Sequence, bitsets: Optional[Dict] = None):
+        self.results = {}
+        if bitsets is not None:
+            # bitsets already computed (bank_index.MappedBank): the questions
+            # are kept as given, they are created when a query returns them
+            self.questions = questions
+            self.all = (1 << len(self.questions)) - 1
+            self.bitsets = bitsets
+            return
+
+        self.questions = list(questions)
+        self.all = (1 << len(self.questions)) - 1
+
+        positions = {}
+        for pos, question in enumerate(self.questions):
+            for tag in question.tags:
+                positions.setdefault(tag, []).append(pos)
+
+        self.bitsets = {}
+        size = len(self.questions) // 8 + 1
+        for tag, tag_positions in positions.items():
+            bitset = bytearray(size)
+            for pos in tag_positions:
+                bitset[pos >> 3] |= 1 << (pos & 7)
+            self.bitsets[tag] = int.from_bytes(bitset, "little")
+
+    def look_compatible_questions(self, tag_description: List) -> Tuple:
+        """
+        Look for questions with the conditions in tag_description.
+
+        Same result as look_compatible_questions (function) but evaluated
+        with the bitsets of the index. The result is a tuple memoized by
+        query, so repeated lemmas share the same sequence.
+        """
+        key = tuple(tag_description)
+        if key not in self.results:
+            bits = compile_query(tag_description)(self)
+            self.results[key] = tuple(
+                self.questions[pos] for pos in bit_positions(bits)
+            )
+
+        return self.results[key]
@@ -0,0 +1,53 @@
+"""
+Tests of the expansion of macros (macro_engine2_single)
+
+    python -m pytest tests
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+# the modules of rand-exam are in the parent directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from macro_engine2 import MacroEngine  # pylint: disable=wrong-import-position
+
+
+def expand(macros, text):
+    """
+    text with its macros expanded, with the user macros {key: value} (the
+    args of parametric macros are given as "KEY,ARG,...")
+    """
+    definitions = []
+    for key, value in macros.items():
+        key, *args = key.split(",")
+        if args:
+            definitions.append(
+                {"constant": False, "key": key, "args": args, "value": value}
+            )
+        else:
+            definitions.append({"constant": True, "key": key, "value": value})
+    return MacroEngine(definitions).expand({"metadata": {}}, text)
+
+
+def test_nested_same_macro():
+    macros = {"DOUBLE,X": "((CALC,X,2,*))"}
+    assert expand(macros, "((DOUBLE,((DOUBLE,3))))") == "12.0"
+    assert expand(macros, "[((DOUBLE,((DOUBLE,((DOUBLE,1))))))]") == "[8.0]"
+
+
+def test_same_macro_from_another_macro():
+    macros = {"DOUBLE,X": "((CALC,X,2,*))", "QUAD,X": "((DOUBLE,((DOUBLE,X))))"}
+    assert expand(macros, "((QUAD,3))") == "12.0"
+
+
+def test_recursive_macro():
+    with pytest.raises(ValueError, match="Recursive macro: R -> R"):
+        expand({"R": "a((R))"}, "((R))")
+
+
+def test_mutually_recursive_macros():
+    with pytest.raises(ValueError, match="Recursive macro: A -> B -> A"):
+        expand({"A": "((B))", "B": "(((A)))"}, "((A))")
@@ -0,0 +1,143 @@
+"""
+YAML loading using the libyaml C loader when PyYAML was built with it.
+Otherwise, the pure python loader is used (same results, slower).
+
+yaml is imported the first time a file is loaded, so the command line starts
+without it (--help, --list-ops, ...).
+"""
+
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def select_loader():
+    """
+    yaml module, the fastest safe loader available and its name
+    """
+    import yaml  # pylint: disable=import-outside-toplevel
+
+    try:
+        return yaml, yaml.CSafeLoader, "CSafeLoader (libyaml)"
+    except AttributeError:
+        return yaml, yaml.SafeLoader, "SafeLoader (python)"
+
+
+def loader_name() -> str:
+    """
+    Name of the loader used
+    """
+    return select_loader()[2]
+
+
+def safe_load(stream):
+    """
+    Equivalent to yaml.safe_load with the fastest loader available
+    """
+    yaml, loader, _name = select_loader()
+    return yaml.load(stream, Loader=loader)
+
+
+def safe_load_all(stream):
+    """
+    Equivalent to yaml.safe_load_all with the fastest loader available
+    """
+    yaml, loader, _name = select_loader()
+    return yaml.load_all(stream, Loader=loader)
+
+
+BOM = "\ufeff"
+
+
+def strip_bom(text: str) -> str:
+    """
+    text without the byte order mark at the start. The reader of yaml skips it
+    without counting it in the positions (spans) of the documents.
+    """
+    if text.startswith(BOM):
+        return text[len(BOM) :]
+    return text
+
+
+class Lazy:
+    """
+    Value of the keys not constructed by load_metadata_all
+    """
+
+    def __repr__(self) -> str:
+        return "LAZY"
+
+
+LAZY = Lazy()
+
+
+def load_metadata_all(stream, keys):
+    """
+    Equivalent to safe_load_all, but in each document (a mapping) only the
+    values of keys are constructed. The rest of keys get the value LAZY.
+
+    Yield (document, span) with span the (start, end) positions (chars) of the
+    document in the stream: safe_load(text[start:end]) is the whole document
+    (see question.load_fields). Documents that are not a mapping of string keys
+    are constructed completely and their span is None.
+
+    stream has to be the text (see strip_bom), so the spans can be checked:
+    the first one is parsed again and its metadata compared.
+    """
+    _yaml, loader_class, _name = select_loader()
+    loader = loader_class(stream)
+    checked = False
+    try:
+        while loader.check_node():
+            node = loader.get_node()
+            document = None
+            if node.tag == "tag:yaml.org,2002:map" and node.id == "mapping":
+                document = {}
+                for key_node, value_node in node.value:
+                    # merge (<<), value (=) and non string keys are left to
+                    # construct_document
+                    if key_node.tag != "tag:yaml.org,2002:str":
+                        document = None
+                        break
+                    key = loader.construct_object(key_node, deep=True)
+                    if key in document:
+                        document = None
+                        break
+                    if key in keys:
+                        document[key] = loader.construct_object(value_node, deep=True)
+                    else:
+                        document[key] = LAZY
+
+            if document is None:
+                yield loader.construct_document(node), None
+            else:
+                span = (node.start_mark.index, node.end_mark.index)
+                if not checked:
+                    check_span(stream, node.start_mark, span, document)
+                    checked = True
+                yield document, span
+
+            loader.constructed_objects = {}
+            loader.recursive_objects = {}
+    finally:
+        loader.dispose()
+
+
+def check_span(text: str, start_mark, span, document):
+    """
+    Check that text[start:end] is the document: start is at the column of
+    start_mark and the slice has the metadata (values constructed by
+    load_metadata_all)
+    """
+    start, end = span
+    line_start = text.rfind("\n", 0, start) + 1
+    sliced = None
+    if start - line_start == start_mark.column:
+        sliced = safe_load(text[start:end])
+    if not isinstance(sliced, dict) or any(
+        sliced.get(key, LAZY) != value
+        for key, value in document.items()
+        if value is not LAZY
+    ):
+        raise ValueError(
+            f"position {start}-{end} of the document doesn't match its text"
+        )